@@ -1,29 +1,35 @@
 import asyncio
-import json
 import discord
 import random
 import praw
-import requests
 import twitter
 import facebook
 import pytumblr
 import time
 import pytz
+import re
 import petal
 from urllib.parse import urlencode
 from datetime import datetime as dt
 from datetime import timedelta
 
 from .dbhandler import m2id
+from .fanout import Fanout
+from .subindex import SubIndex
 from .grasslands import Octopus
 from .grasslands import Giraffe
+from .grasslands import Squirrel
 from .grasslands import Peacock
 from .grasslands import Pidgeon
+from .grasslands import PelicanError, pelican
 from .mcname import *
 
 from random import randint
 version = "0.5.0.9"
 
+DURATION = re.compile(r"(\d+(?:\.\d+)?)\s*(w|d|h|m|s)?", re.IGNORECASE)
+DURATION_UNITS = {"w": 604800, "d": 86400, "h": 3600, "m": 60, "s": 1}
+
 
 class Commands:
 
@@ -43,6 +49,7 @@ class Commands:
         self.active_sad = []
         self.log.info("Loading Command module...")
         self.support_dict = {}
+        self.subindex = None
         self.osuKey = self.config.get("osu")
         if self.osuKey is not None:
             self.o = Octopus(self.osuKey)
@@ -53,6 +60,16 @@ class Commands:
         self.imgurKey = self.config.get("imgur")
         if self.imgurKey is not None:
             self.i = Giraffe(self.imgurKey)
+            prefetch = self.config.doc.get("prefetch") or {}
+            self.squirrel = Squirrel(self.i,
+                                     prefetch.get("subreddits",
+                                                  ["cat", "birb", "dog",
+                                                   "penguin", "ferret",
+                                                   "panda"]),
+                                     size=prefetch.get("size", 10),
+                                     low=prefetch.get("low", 3),
+                                     permitNSFW=lambda:
+                                     self.config.permitNSFW)
         else:
             self.log.warn("No imgur key found.")
         if self.config.get("reddit") is not None:
@@ -103,32 +120,61 @@ class Commands:
             self.log.ready("Tumblr support Enabled!")
         else:
             self.log.warn("No Tumblr keys found.")
+        self.build_registry()
         self.log.ready("Command Module Loaded!")
+
+    def build_registry(self):
+        """
+        Builds the invoker -> (kind, method) table used to dispatch commands.
+        Custom commands from config are added first, then aliases, then every
+        coroutine with a docstring, so built in commands win on name clashes.
+        Call again whenever config is reloaded
+        """
+        registry = {}
+        for invoker in self.config.commands:
+            registry[invoker] = ("custom", self.parseCustom)
+
+        for invoker in self.config.aliases:
+            method = getattr(self, self.config.aliases[invoker], None)
+            if method is None:
+                self.log.warn("Alias " + invoker + " points to a command that"
+                              " does not exist: "
+                              + str(self.config.aliases[invoker]))
+                continue
+            registry[invoker] = ("alias", method)
+
+        for name in dir(self):
+            if name.startswith("_"):
+                continue
+            method = getattr(self, name)
+            if asyncio.iscoroutinefunction(method) and method.__doc__ is not None:
+                registry[name] = ("command", method)
+
+        self.registry = registry
+        self.log.f("Commands", "Registered " + str(len(registry))
+                   + " invokers")
+        return registry
+
     def level0(self, author):
         # this supercedes all other levels so, use it carefully
         return author.id == str(self.config.owner)
 
     def level1(self, author):
-        return author.id in self.config.l1 or self.level0(author)
+        return self.get_user_level(author) <= 1
 
     def level2(self, author):
-        return author.id in self.config.l2 or self.level1(author)
+        return self.get_user_level(author) <= 2
 
     def level3(self, author):
-        return author.id in self.config.l3 or self.level2(author)
+        return self.get_user_level(author) <= 3
 
     def level4(self, author):
-        return author.id in self.config.l4 or self.level3(author)
+        return self.get_user_level(author) <= 4
 
     def get_user_level(self, author):
-        count = 0
         if self.level0(author):
             return 0
-        for l in self.config.get("level"):
-            count += 1
-            if author.id in self.config.get("level")[l]:
-                return count
-        return 5
+        return self.config.levels.get(author.id, 5)
 
     @staticmethod
     def check(message):
@@ -147,6 +193,26 @@ class Commands:
             return True
         return False
 
+    @staticmethod
+    def parse_duration(text):
+        """
+        Reads durations like 1d2h30m. A bare number counts as minutes
+        :param text: str duration
+        :return: seconds, or None if text isn't a duration
+        """
+        text = text.strip()
+        pos = 0
+        seconds = 0
+        for match in DURATION.finditer(text):
+            if text[pos:match.start()].strip() not in ("", ","):
+                return None
+            unit = (match.group(2) or "m").lower()
+            seconds += float(match.group(1)) * DURATION_UNITS[unit]
+            pos = match.end()
+        if pos == 0 or text[pos:].strip() != "":
+            return None
+        return seconds
+
     @staticmethod
     def check_is_numeric(message):
         try:
@@ -228,38 +294,25 @@ class Commands:
         else:
             return False
 
-    # TODO: Convert to Mongo
-    def get_event_subscription(self, post):
+    async def _get_subindex(self):
+        """
+        Builds the sub keyword index the first time it's needed
+        """
+        if self.subindex is None:
+            self.subindex = SubIndex(await self.db.get_subs())
+            self.log.f("subs", "Indexed " + str(len(self.subindex)) + " subs")
+        return self.subindex
 
-        print(post)
-        postdata = post.lower().split(' ')
+    async def get_event_subscription(self, post):
 
-        subs = list(self.db.subs.find({}))
-        if len(subs) == 0:
+        index = await self._get_subindex()
+        if len(index) == 0:
             self.log.f("event", "Subscription list empty. Ignoring...")
             return None, None
-        # print(str(postdata))
-        self.log.f("subs", "Searching for explicit tags")
-        for item in subs:
-            if "[{}]".format(item["code"]) in post:
-                return item["code"], item["name"]
-        for item in subs:
-            # print(item["name"] + item["code"])
-
-            if item["code"].lower() in postdata:
-                return item["code"], item["name"]
-            for word in item["name"].split(' '):
-                # print(word)
-
-                if word.lower() in ["and", "of", "the", "or", "with", "to", "from", "by", "on", "or"]:
-                    continue
-
-                if word.lower() in postdata:
-                    return item["code"], item["name"]
-
-
-        self.log.f("event", "could not find subscription key in your announcement")
-        return None, None
+        code, name = index.find(post)
+        if code is None:
+            self.log.f("event", "could not find subscription key in your announcement")
+        return code, name
 
 
     async def list_connected_servers(self, message):
@@ -285,61 +338,44 @@ class Commands:
     # for your own personal uses if you like. You will need a mongoDB instance and be familiar with pyMongo
     # I personally prefer the free cloud.mongodb.com instances they have available.
 
-    async def notify_subscribers(self, source_channel, target_message, key):
-        await self.client.send_message(None, source_channel, "Notifying subscribers...")
-        sub = self.db.subs.find_one({"code": key})
+    async def notify_subscribers(self, source_channel, target_message, key, author=None):
+        sub = await self.db.get_sub(key)
         if sub is None:
             return "Error, could not find that subscription anymore. Which shouldn't ever happen. Ask isometricramen about it."
-        status = "```\n"
         total = len(sub["members"])
         if len(sub["members"]) == 0:
             return "Nobody is subscribed to this game. "
-        count = 0
-        for member in sub["members"]:
-            mem = self.get_member(target_message, member)
-            if mem is None:
-                status += member + " is missing\n"
-            else:
-                try:
-                    await self.client.send_message(None, mem, "Hello! Hope your day/evening/night/morning is going well\n\nI was just popping in here to let you know that an event for `{}` has been announced.".format(sub["name"])  +
-                                                                    "\n\nIf you wish to stop receiving these messages, just do `{}unsubscribe {}` in the same server in which you subscribed originally.".format(self.config.prefix, sub["code"]))
-                except discord.errors.ClientException:
-                    status += member + " blocked PMs\n"
-                else:
-                    status += mem.name + " PMed\n"
-                    count += 1
-            if len(status) > 1900:
-                await self.client.send_message(None, source_channel, status + "```")
-                await asyncio.sleep(0.5)
-                status = "```\n"
-        if len(status) > 0:
-            await self.client.send_message(None, source_channel, status + "```")
+        content = ("Hello! Hope your day/evening/night/morning is going well\n\nI was just popping in here to let you know that an event for `{}` has been announced.".format(sub["name"]) +
+                   "\n\nIf you wish to stop receiving these messages, just do `{}unsubscribe {}` in the same server in which you subscribed originally.".format(self.config.prefix, sub["code"]))
+        fanout = Fanout(self.client, **(self.config.doc.get("fanout") or {}))
+        outcomes = await fanout.send(target_message.server, sub["members"],
+                                     content, source_channel,
+                                     title="Notifying subscribers")
+        await self.db.record_notification(sub["code"], author, outcomes)
+        count = sum(1 for o in outcomes.values() if o == "sent")
         return str(count) + " out of " + str(total) + " subscribed members were notified. "
 
     async def check_pa_updates(self, force=False):
             if force:
-                self.config.doc["lastRun"] = dt.utcnow()
-                self.config.save()
+                self.config.state.set("lastRun", dt.utcnow())
 
             else:
-                last_run = self.config.get("lastRun")
+                last_run = self.config.state.get("lastRun")
                 self.log.f("pa", "Last run at: " + str(last_run))
                 if last_run is None:
                     last_run = dt.utcnow()
-                    self.config.doc["lastRun"] = last_run
-                    self.config.save()
+                    self.config.state.set("lastRun", last_run)
                 else:
                     difference = (dt.utcnow() - dt.strptime(str(last_run), '%Y-%m-%d %H:%M:%S.%f')).total_seconds()
                     self.log.f("pa", "Difference: " + str(difference))
                     if difference < 86400:
                         return
                     else:
-                        self.config.doc["lastRun"] = dt.utcnow()
-                        self.config.save()
+                        self.config.state.set("lastRun", dt.utcnow())
 
 
             self.log.f("pa", "Searching for entries...")
-            response = self.db.get_motd_entry(update=True)
+            response = await self.db.get_motd_entry(update=True)
 
 
             if response is None:
@@ -435,19 +471,19 @@ class Commands:
         user = message.author.name
         if uid.strip() == "":
             if self.db.useDB:
-                m = self.db.get_attribute(message.author, "osu")
+                m = await self.db.get_attribute(message.author, "osu")
                 if m is None:
                     m = ""
                 if m != "":
                     user = m
 
-            user = self.o.get_user(user)
+            user = await self.o.get_user(user)
 
             if user is None:
                 return ("Looks like there is no osu data associated with" +
                         " your discord name")
         else:
-            user = self.o.get_user(uid.split('|')[0])
+            user = await self.o.get_user(uid.split('|')[0])
             if user is None:
                 return "No user found with Osu! name: " + uid.split('|')[0]
 
@@ -508,6 +544,7 @@ class Commands:
         else:
             self.config.commands[invoker] = {"com": command, "perm": perms}
             self.config.save()
+            self.build_registry()
             return "New Command `{}` Created!".format(invoker)
 
 
@@ -536,44 +573,22 @@ class Commands:
                                            "\n\nMore Info with: " + self.config.prefix +
                                            "statsfornerds", )
             return
-        if func in dir(self):
-            if getattr(self, func).__doc__ is None:
-                return "No help info for function: " + func
-            else:
-                helptext = getattr(self, func).__doc__.split("\n")
-                em = discord.Embed(title=func, description=helptext[1],
-                                   colour=0x0acdff)
+        entry = self.registry.get(func)
+        if entry is None or entry[0] == "custom":
+            return func + " is not a valid command"
+        if entry[1].__doc__ is None:
+            return "No help info for function: " + func
+
+        helptext = entry[1].__doc__.split("\n")
+        em = discord.Embed(title=func, description=helptext[1],
+                           colour=0x0acdff)
 
-                em.set_author(name="Petal Help",
-                              icon_url=self.client.user.avatar_url)
+        em.set_author(name="Petal Help",
+                      icon_url=self.client.user.avatar_url)
 
-                em.set_thumbnail(url=self.client.user.avatar_url)
-                em.add_field(name="Syntax", value=helptext[2])
-                await self.client.embed(message.channel, em)
-        else:
-            try:
-                dir(self.config.aliases[func])
-            except KeyError:
-                return func + " is not a valid command"
-            else:
-                pass
-
-            if getattr(self, self.config.aliases[func]).__doc__ is None:
-                return "No help for function: " + func
-            else:
-                helptext = getattr(self, (self.config.aliases[func]).
-                                   __doc__.split("\n"))
-                em = discord.Embed(title=func, description=helptext[1],
-                                   colour=0x0acdff)
-                em.set_author(name="Petal Help",
-                              icon_url=self.client.user.avatar_url)
-                em.set_thumbnail(url=self.client.user.avatar_url)
-                em.add_field(name="Syntax", value=helptext[2])
-                await self.client.embed(message.channel, em)
-                return ("__**Help Information For {}**__:\n{}"
-                        .format(func,
-                                getattr(self,
-                                        self.config.aliases[func]).__doc__))
+        em.set_thumbnail(url=self.client.user.avatar_url)
+        em.add_field(name="Syntax", value=helptext[2])
+        await self.client.embed(message.channel, em)
 
     async def freehug(self, message):
         """
@@ -588,7 +603,7 @@ class Commands:
 
         if args[0] == '':
             valid = []
-            for m in self.config.hugDonors:
+            for m in self.config.state.donors():
                 user = self.get_member(message, m)
                 if user is not None:
                     if (user.status == discord.Status.online
@@ -610,8 +625,7 @@ class Commands:
                 return ("Your hug donor was going to be: " + pick.mention +
                         " but unfortunately they were unable to be contacted")
             else:
-                self.config.hugDonors[pick.id]["donations"] += 1
-                self.config.save()
+                self.config.state.add_donation(pick.id)
                 return "A hug has been requested of: " + pick.name
 
         if args[0].lower() == 'add':
@@ -620,12 +634,10 @@ class Commands:
             user = self.get_member(message, args[1].lower())
             if user is None:
                 return "No valid user found for " + args[1]
-            if user.id in self.config.hugDonors:
+            if self.config.state.is_donor(user.id):
                 return "That user is already a hug donor"
 
-            self.config.hugDonors[user.id] = {"name": user.name,
-                                              "donations": 0}
-            self.config.save()
+            self.config.state.add_donor(user.id, user.name)
             return "{} added to the donor list".format(user.name)
 
         elif args[0].lower() == 'del':
@@ -634,32 +646,28 @@ class Commands:
             user = self.get_member(message, args[1].lower())
             if user is None:
                 return "No valid user for " + args[1]
-            if user.id not in self.config.hugDonors:
+            if not self.config.state.is_donor(user.id):
                 return "That user is not a hug donor"
 
-            del self.config.hugDonors[user.id]
+            self.config.state.remove_donor(user.id)
             return "{} was removed from the donor list".format(user.name)
 
         elif args[0].lower() == 'status':
-            if message.author.id not in self.config.hugDonors:
+            donations = self.config.state.donations(message.author.id)
+            if donations is None:
                 return ("You are not a hug donor, user `freehug donate` to " +
                         "add yourself")
 
             return ("You have received {} requests since you became a donor"
-                    .format(self.config.hugDonors
-                            [message.author.id]["donations"]))
+                    .format(donations))
 
         elif args[0].lower() == 'donate':
-            if message.author.id not in self.config.hugDonors:
-                self.config.hugDonors[message.author.id] = {"name":
-                                                            message.author
-                                                            .name,
-                                                            "donations": 0}
-                self.config.save()
+            if not self.config.state.is_donor(message.author.id):
+                self.config.state.add_donor(message.author.id,
+                                            message.author.name)
                 return "Thanks! You have been added to the donor list <3"
             else:
-                del self.config.hugDonors[message.author.id]
-                self.config.save()
+                self.config.state.remove_donor(message.author.id)
                 return "You have been removed from the donor list."
 
     async def promote(self, message):
@@ -689,6 +697,7 @@ class Commands:
                     self.config.get("level")[l].remove(mem.id)
 
             self.config.get("level")["l" + str(mlv - 1)].append(mem.id)
+            self.config.reindex()
 
             self.config.save()
             return mem.name + " was promoted to level: " + str(mlv - 1)
@@ -718,6 +727,8 @@ class Commands:
                 for l in self.config.get("level"):
                     if mem.id in self.config.get("level")[l]:
                         self.config.get("level")[l].remove(mem.id)
+                self.config.reindex()
+                self.config.save()
                 return "All perms removed"
             if mlv == 5:
                 return "Person has no perms, and therefor cannot be demoted"
@@ -726,6 +737,7 @@ class Commands:
                     self.config.get("level")[l].remove(mem.id)
 
             self.config.get("level")["l" + str(mlv + 1)].append(mem.id)
+            self.config.reindex()
             self.config.save()
             return mem.name + " was promoted to level: " + str(mlv + 1)
         else:
@@ -749,7 +761,9 @@ class Commands:
             return "Imgur Support is disabled by administrator"
 
         try:
-            ob = self.i.get_subreddit(sr)
+            ob = self.squirrel.take(sr)
+            if ob is None:
+                ob = await self.i.get_subreddit(sr)
             if ob is None:
                 return ("Sorry, I couldn't find any images in subreddit: `" +
                         sr + "`")
@@ -779,14 +793,13 @@ class Commands:
         if args[0] == '':
             return "Sorry mate, I can't do much with that. Make sure you put a subscription key (`" + self.config.prefix + "subs list`)"
 
-        sub = self.db.subs.find_one({"code": args[0].upper()})
+        sub, already = await self.db.subscribe(args[0].upper(), message.author.id)
 
         if sub is None:
             return "Sadly, that game doesn't exist. However, you can ask for it to be added!"
-        sub["members"].append(message.author.id)
-        self.db.subs.update({"_id": sub["_id"]}, {"$set": {"members" : sub["members"]}})
+        if already:
+            return "You are already subscribed to `{}`".format(sub["name"])
         self.log.f("subs", "Added: " + message.author.name + " ({})".format(message.author.id))
-        #self.db.update_member(message.author, {"subscriptions": args[0].upper()})
         return "Alright, You're all set to receive notifications when there is an event involving: " + sub["name"]
 
     async def unsubscribe(self, message):
@@ -798,15 +811,13 @@ class Commands:
         if args[0] == '':
             return "Sorry mate, I cant do much with that. Make sure you put a subscription key (`" + self.config.prefix + "subs list`)"
 
-        sub = self.db.subs.find_one({"code":args[0].upper()})
+        sub, was_member = await self.db.unsubscribe(args[0].upper(), message.author.id)
         if sub is None:
             return "Sadly, that game doesn't exist. However, you can ask for it to be added!"
 
-        if message.author.id not in sub["members"]:
+        if not was_member:
             return "It seems you are not subscribed to `{}`".format(sub["name"])
         else:
-            sub["members"].remove(message.author.id)
-            self.db.subs.update({"_id": sub["_id"]}, {"$set": {"members": sub["members"]}})
             self.log.f("subs", "Removed: " + message.author.name + " ({})".format(message.author.id))
             return "You have been sucessfully unsubscribed from " + sub["name"] + ".\nYou will no longer receive notfications from me for this game unless you re-subscribe"
 
@@ -815,7 +826,12 @@ class Commands:
         Shows what events you are subscribed to
         >mysubs
         """
-        return "Disabled for now"
+        subs = await self.db.get_member_subs(message.author.id)
+        if len(subs) == 0:
+            return ("You aren't subscribed to anything. See `" + self.config.prefix
+                    + "subs list` for what you can subscribe to")
+        return "You are subscribed to:\n```\n" + "\n".join(
+            entry["name"] + " [{}]".format(entry["code"]) for entry in subs) + "\n```"
 
 
 
@@ -836,19 +852,21 @@ class Commands:
                 return ("Format is: " + self.config.prefix
                         + "subs add | <game name> | <game code (4 digit)>")
 
-            if self.db.subs.find_one({"name": args[1]}) is not None:
+            if await self.db.get_sub_by_name(args[1]) is not None:
                 return "That sub already exists. Delete it first to replace it"
-            code = self.db.subs.find_one({"code": args[2].upper()})
+            code = await self.db.get_sub(args[2].upper())
 
             if code is not None:
                 return "That code is in use for: " + code["name"]
-            self.db.subs.insert_one({"name": args[1], "code": args[2].upper(), "members": []})
+            await self.db.add_sub(args[1], args[2].upper())
+            if self.subindex is not None:
+                self.subindex.add(args[2].upper(), args[1])
 
             return "Added " + args[1] + " with key: " + args[2].upper()
 
         elif args[0].lower() == "list":
 
-            data = list(self.db.subs.find({}))
+            data = await self.db.get_subs()
             if len(data) == 0:
                 return "No entries found..."
             else:
@@ -867,12 +885,14 @@ class Commands:
                 return ("Format is: " + self.config.prefix
                         + "subs del | <game code (4 digit)>")
 
-            item = self.db.subs.find_one({"code": args[1].upper()})
+            item = await self.db.get_sub(args[1].upper())
             if item is None:
                 return "No sub found with code: " + args[1].upper()
 
             else:
-                self.db.subs.delete_one({"code": args[1].upper()})
+                await self.db.delete_sub(args[1].upper())
+                if self.subindex is not None:
+                    self.subindex.remove(item["code"])
                 return "Deleted " + item["name"] + " [{}]".format(item["code"])
 
     async def event(self, message):
@@ -968,7 +988,7 @@ class Commands:
 
         await self.client.send_message(message.author, message.channel, "Messages have been posted", )
 
-        subkey, friendly = self.get_event_subscription(msgstr)
+        subkey, friendly = await self.get_event_subscription(msgstr)
 
 
 
@@ -991,7 +1011,7 @@ class Commands:
 
 
             if n.content == "yes":
-                response = await self.notify_subscribers(message.channel, posted[0], subkey)
+                response = await self.notify_subscribers(message.channel, posted[0], subkey, message.author)
                 todelete = "[{}]".format(subkey)
                 ecount = 0
                 for post in posted:
@@ -1061,17 +1081,14 @@ class Commands:
         """
         msg = await self.client.send_message(message.author, message.channel, "*hugs*", )
         delta = int((dt.now() - msg.timestamp).microseconds / 1000)
-        self.config.stats['pingScore'] += delta
-        self.config.stats['pingCount'] += 1
-
-        self.config.save(vb=0)
-        truedelta = int(self.config.stats['pingScore'] /
-                        self.config.stats['pingCount'])
+        score = self.config.state.incr("pingScore", delta)
+        count = self.config.state.incr("pingCount")
+        truedelta = int(score / count)
 
         return ("Current Ping: {}ms\nPing till now: {}ms of {} pings"
                 .format(str(delta),
                         str(truedelta),
-                        str(self.config.stats['pingCount'])))
+                        str(count)))
 
     async def weather(self, message):
         """
@@ -1101,18 +1118,10 @@ class Commands:
         Lists all commands
         >commands
         """
-        method_list = [func for func in dir(Commands) if callable(getattr(
-                                                              Commands,
-                                                                  func))]
         formattedList = ""
-        for f in method_list:
-            methodToCall = getattr(Commands, str(f))
-            if methodToCall.__doc__ is None:
-                self.log.f("Command List", "Ignoring " + f)
-            elif str(f).startswith("__"):
-                self.log.f("Command List", "Ignoring Builtin" + f)
-            else:
-                formattedList += (str(f) + "\n")
+        for f in sorted(self.registry):
+            if self.registry[f][0] == "command":
+                formattedList += (f + "\n")
 
         return "```\n" + formattedList + "```"
 
@@ -1313,6 +1322,10 @@ class Commands:
         if not self.check_user_has_role(message.author, "mod"):
             return "you do not have sufficient perms"
 
+        if not self.db.useDB:
+            return ("Database is not enabled, so I can't remember to unban "
+                    "anyone. Use " + self.config.prefix + "ban instead")
+
         logChannel = message.server.get_channel(self.config.get("logChannel"))
         if logChannel is None:
             return ("I'm sorry, you must have logging enabled to" +
@@ -1340,13 +1353,21 @@ class Commands:
             return "Could not get user with that id"
 
         else:
+            petal.logLock = True
             try:
-                petal.logLock = True
-                timex = time.time() + timedelta(days=int(msg2.content.strip())).total_seconds()
-                self.db.update_member(userToBan, {"banned": True, "bannedFrom": userToBan.server.id, "banExpires": str(timex).split('.')[0] })
+                timex = int(time.time() + timedelta(days=int(msg2.content.strip())).total_seconds())
+                await self.db.update_member(userToBan, {"banned": True, "bannedFrom": userToBan.server.id})
                 await self.client.ban(userToBan)
+                # Scheduled first so the unban still happens this session if the insert fails
+                self.client.schedule_unban(userToBan.id, userToBan.server.id, timex)
+                await self.db.add_ban(userToBan.id, userToBan.server.id, timex)
             except discord.errors.Forbidden as ex:
                 return "It seems I don't have perms to ban this user"
+            except Exception as e:
+                self.log.err("Could not store tempban for " + userToBan.id
+                             + ": " + type(e).__name__ + " " + str(e))
+                return ("Something went wrong saving the tempban. If " + userToBan.name
+                        + " was banned, the unban may be lost on restart, so please check on it")
             else:
                 logEmbed = discord.Embed(title="User Ban",
                                          description=msg.content,
@@ -1367,9 +1388,10 @@ class Commands:
                                         self.config.modChannel), logEmbed)
                 await self.client.send_message(message.author, message.channel, "Clearing out messages... ", )
                 await asyncio.sleep(4)
-                petal.logLock = False
                 return (userToBan.name + " (ID: " + userToBan.id +
                         ") was successfully temp-banned\n\nThey will be unbanned on " + str(dt.utcnow() + timedelta(days=int(msg2.content)))[:-7])
+            finally:
+                petal.logLock = False
 
     async def warn(self, message):
         """
@@ -1595,13 +1617,15 @@ class Commands:
         """
         args = self.clean_input(message.content)
         if args[0] == "":
-            response = self.db.get_void()
+            response = await self.db.get_void()
+            if response is None:
+                return "Nothing in void storage"
             author = response["author"]
             num = response["number"]
             response = response["content"]
 
             if "@everyone" in response or "@here" in response:
-                self.db.delete_void()
+                await self.db.delete_void(num)
                 return "Someone (" + author + ") is a butt and tried to " \
                                               "sneak an @ev tag into the void." \
                                               "\n\nIt was deleted..."
@@ -1612,9 +1636,9 @@ class Commands:
                 self.log.f("VOID", message.author.name + " retrieved " + str(num) + " from the void")
                 return response
         else:
-            count = self.db.save_void(args[0],
-                                      message.author.name,
-                                      message.author.id)
+            count = await self.db.save_void(args[0],
+                                            message.author.name,
+                                            message.author.id)
 
             if count is not None:
                 return "Added item number " + str(count) + " to the void"
@@ -1780,11 +1804,11 @@ class Commands:
             if mem is None:
                 return "Couldnt find user with ID: " + args[0]
 
-            if mem.id in self.config.blacklist:
-                self.config.blacklist.remove(mem.id)
+            if mem.id in self.config.state.blacklisted:
+                self.config.state.unblacklist(mem.id)
                 return mem.name + " was given the ability to use petal again"
             else:
-                self.config.blacklist.append(mem.id)
+                self.config.state.blacklist(mem.id)
                 return mem.name + " was blacklisted"
 
     async def calm(self, message):
@@ -1801,12 +1825,13 @@ class Commands:
             await self.client.send_message(message.author, message.channel, "You will be held accountable for" +
                                            " whatever you post in here." +
                                            " Just a heads up ^_^ ", )
-            gal.append({"author": message.author.name + " " +
-                       message.author.id,
-                       "content": args[0].strip()})
-            self.config.save()
+            self.config.state.gallery_add("calm", message.author.name + " " +
+                                          message.author.id, args[0].strip())
         else:
-            return gal[random.randint(0, len(gal)-1)]["content"]
+            entry = self.config.state.gallery_random("calm")
+            if entry is None:
+                return "The calm gallery is empty, add something to it first"
+            return entry
 
     async def comfypixel(self, message):
         """
@@ -1822,12 +1847,13 @@ class Commands:
             await self.client.send_message(message.author, message.channel, "You will be held accountable " +
                                            "for whatever is posted in here." +
                                            " Just a heads up ^_^ ", )
-            gal.append({"author": message.author.name + " " +
-                        message.author.id,
-                        "content": args[0].strip()})
-            self.config.save()
+            self.config.state.gallery_add("comfy", message.author.name + " " +
+                                          message.author.id, args[0].strip())
         else:
-            return gal[random.randint(0, len(gal)-1)]["content"]
+            entry = self.config.state.gallery_random("comfy")
+            if entry is None:
+                return "The comfy gallery is empty, add something to it first"
+            return entry
     async def aww(self, message):
         """
         Brings up a random image from the cute gallery. Or adds it
@@ -1840,12 +1866,13 @@ class Commands:
             return "Sadly, aww hasn't been set up correctly"
         if args[0] != '':
             await self.client.send_message(message.author, message.channel, "You will be held accountable " +                                           "for whatever is posted in here.  Just a heads up ^_^ ", )
-            gal.append({"author": message.author.name + " " +
-                        message.author.id,
-                        "content": args[0].strip()})
-            self.config.save()
+            self.config.state.gallery_add("cute", message.author.name + " " +
+                                          message.author.id, args[0].strip())
         else:
-            return gal[random.randint(0, len(gal)-1)]["content"]
+            entry = self.config.state.gallery_random("cute")
+            if entry is None:
+                return "The cute gallery is empty, add something to it first"
+            return entry
 
     async def gmt(self, message):
         """
@@ -1876,7 +1903,7 @@ class Commands:
         args = self.clean_input(message.content)
 
         if args[0] == "submit":
-            response = self.db.submit_motd(message.author.id, " ".join(args[1:]))
+            response = await self.db.submit_motd(message.author.id, " ".join(args[1:]))
             if response is None:
                 return "Unable to add to database, ask your bot owner as to why"
 
@@ -1901,7 +1928,7 @@ class Commands:
             if not self.check_is_numeric(args[1]):
                 return "Entry must be an integer"
 
-            result = self.db.update_motd(int(args[1]))
+            result = await self.db.update_motd(int(args[1]))
             if result is None:
                 return "No entries exist with id number: " + args[1]
 
@@ -1925,7 +1952,7 @@ class Commands:
             if not self.check_is_numeric(args[1]):
                 return "Entry must be an integer"
 
-            result = self.db.update_motd(int(args[1]), approve=False)
+            result = await self.db.update_motd(int(args[1]), approve=False)
             if result is None:
                 return "No entries exist with id number: " + args[1]
 
@@ -1940,7 +1967,7 @@ class Commands:
             await self.client.embed(chan, newEmbed)
 
         elif args[0] == 'list':
-            count = self.db.motd.count({"approved": True, "used": False})
+            count = await self.db.count_motd()
             return "Patch Asks list is not a thing, scroll up in the channel to see whats up\n" + str(count) + " available in the queue."
 
     async def paforce(self, message):
@@ -1966,8 +1993,9 @@ class Commands:
         >save
         """
         if self.level0(message.author):
-            self.config.save(vb=1)
-            return "Saved"
+            if self.config.flush(vb=1):
+                return "Saved"
+            return "Nothing to save"
 
     async def forceload(self, message):
         """
@@ -1976,6 +2004,8 @@ class Commands:
         """
         if self.level0(message.author):
             self.config.load()
+            self.build_registry()
+            self.client.bind_role_grants()
             return "Loaded config file"
 
     async def anon(self, message):
@@ -2210,19 +2240,28 @@ class Commands:
         Displays stats for nerds
         !statsfornerds
         """
-        truedelta = int(self.config.stats['pingScore'] /
-                        self.config.stats['pingCount'])
+        truedelta = int(self.config.state.counter("pingScore") /
+                        max(self.config.state.counter("pingCount"), 1))
 
         em = discord.Embed(title="Stats",
                            description="*for nerds*",
                            colour=0x0acdff)
         em.add_field(name="Version", value=version)
         em.add_field(name="Uptime", value=self.get_uptime())
-        em.add_field(name="Void Count", value=str(self.db.void.count()))
+        em.add_field(name="Void Count", value=str(await self.db.count_void()))
         em.add_field(name="Servers", value=str(len(self.client.servers)))
         em.add_field(name="Total Number of Commands run",
-                     value=str(self.config.get("stats")["comCount"]))
+                     value=str(self.config.state.counter("comCount")))
         em.add_field(name="Average Ping", value=str(truedelta))
+        cache = self.db.cache_stats()
+        if cache is not None:
+            em.add_field(name="Member Cache",
+                         value="{hits} hits, {misses} misses "
+                               "({size}/{max} members)".format(**cache))
+        em.add_field(name="Response Cache",
+                     value="{hits} hits, {misses} misses "
+                           "({size}/{max} responses)"
+                     .format(**pelican.cache.stats()))
         mc = 0
         for x in self.client.get_all_members():
             mc += 1
@@ -2248,7 +2287,7 @@ class Commands:
         """
         query = message.content.lstrip(self.config.prefix + "wiki")
         self.log.f("wiki", "Query string: " + query)
-        response = Pidgeon(query, version=version).get_summary()
+        response = await Pidgeon(query, version=version).get_summary()
         if response[0] == 0:
             return response[1]
         else:
@@ -2275,8 +2314,10 @@ class Commands:
         args = self.clean_input(message.content)
         target_number = 0
         try:
-            indexresp = json.loads(requests.get("http://xkcd.com/info.0.json").content.decode())
-        except requests.exceptions.ConnectionError:
+            indexresp = await pelican.get_json("http://xkcd.com/info.0.json", cache="xkcd")
+            if indexresp is None:
+                return "XKCD did not return a valid response. It may be down."
+        except PelicanError:
             return "XKCD did not return a valid response. It may be down."
         except ValueError as e:
             return "XKCD response was missing data. Try again. [{}]".format(str(e))
@@ -2299,12 +2340,14 @@ class Commands:
 
         try:
             if target_number != 0:
-                resp = json.loads(requests.get("http://xkcd.com/{0}/info.0.json".format(target_number)).content.decode())
+                resp = await pelican.get_json("http://xkcd.com/{0}/info.0.json".format(target_number), cache="xkcd-comic")
+                if resp is None:
+                    return "There is no xkcd number " + str(target_number)
             else:
-                resp = json.loads(requests.get("http://xkcd.com/info.0.json").content.decode())
+                resp = indexresp
             number = resp["num"]
 
-        except requests.exceptions.ConnectionError:
+        except PelicanError:
             return "XKCD did not return a valid response. It may be down."
         except ValueError as e:
             return "XKCD response was missing data. Try again. [{}]".format(str(e))
@@ -2330,12 +2373,13 @@ class Commands:
             if user is None:
                 return "No user found for that name, try again"
 
-        cb = self.config.get("choppingBlock")
+        entry = self.config.state.get_vote(user.id)
 
-        if user.id in cb:
-            if (cb[user.id]["timeout"] - dt.utcnow()).total_seconds() >= 0:
-                if message.author.id not in cb[user.id]["votes"]:
-                    cb[user.id]["votes"][message.author.id] = 1
+        if entry is not None:
+            if (entry["timeout"] - dt.utcnow()).total_seconds() >= 0:
+                if message.author.id not in entry["votes"]:
+                    entry["votes"][message.author.id] = 1
+                    self.config.state.put_vote(user.id, entry)
                     return "You have voted to promote, " + user.name
                 else:
                     return "You already voted..."
@@ -2346,8 +2390,8 @@ class Commands:
             if self.check_user_has_role(user, "Helping Hands"):
                 return "This user is already a Helping Hands..."
             now = dt.utcnow() + timedelta(days=2)
-            cb[user.id] = {"votes": {message.author.id: 1}, "started_by": message.author.id,
-                           "timeout": now, "server_id": user.server.id}
+            self.config.state.put_vote(user.id, {"votes": {message.author.id: 1}, "started_by": message.author.id,
+                                                 "timeout": now, "server_id": user.server.id})
             return "A vote to promote {0}#{1} has been started, it will end in 48 hours.".format(user.name,
                                                                                                  user.discriminator)\
                    + "\nYou man cancel this vote by running " + self.config.prefix \
@@ -2365,11 +2409,12 @@ class Commands:
             if user is None:
                 return "No user found for that name, try again"
 
-        cb = self.config.get("choppingBlock")
-        if user.id in cb:
-            if (cb[user.id]["timeout"] - dt.utcnow()).total_seconds() >= 0:
-                if message.author.id not in cb[user.id]["votes"]:
-                    cb[user.id]["votes"][message.author.id] = -1
+        entry = self.config.state.get_vote(user.id)
+        if entry is not None:
+            if (entry["timeout"] - dt.utcnow()).total_seconds() >= 0:
+                if message.author.id not in entry["votes"]:
+                    entry["votes"][message.author.id] = -1
+                    self.config.state.put_vote(user.id, entry)
                     return "You have voted to demote, " + user.name
                 else:
                     return "You already voted..."
@@ -2380,7 +2425,8 @@ class Commands:
             if not self.check_user_has_role(user, "Helping Hands"):
                 return "This user is not a member of Helping Hands. I cannot demote them"
             now = dt.utcnow() + timedelta(days=2)
-            cb[user.id] = {"votes": {message.author.id: -1}, "started_by": message.author.id, "timeout": now, "server_id": user.server.id}
+            self.config.state.put_vote(user.id, {"votes": {message.author.id: -1}, "started_by": message.author.id,
+                                                 "timeout": now, "server_id": user.server.id})
             return "A vote to demote {0}#{1} has been started, it will end in 48 hours.".format(user.name,
                                                                                                 user.discriminator) \
                    + "\nYou may cancel this vote by running " + self.config.prefix \
@@ -2411,13 +2457,9 @@ class Commands:
                 return "You didn't reply so I timed out..."
             response = response.content
             if response.lower() in ['promote', 'p']:
-                response = await self.lpromote(message, user)
-                self.config.save()
-                return response
+                return await self.lpromote(message, user)
             elif response.lower() in ['demote', 'd']:
-                response = await self.ldemote(message, user)
-                self.config.save()
-                return response
+                return await self.ldemote(message, user)
             else:
                 await self.client.send_message(message.author, message.channel, "Type promote or type demote [pd]")
                 await asyncio.sleep(1)
@@ -2427,28 +2469,16 @@ class Commands:
         Cancels all lvotes you started. Does not validate them.
         !lcancel
         """
-        cb = self.config.get("choppingBlock")
         if "choppingBlock" not in self.config.doc:
             return "Unable to find the config object associated. You need to add choppingBlock: {} to your config..."
 
         if not self.check_user_has_role(message.author, "Listener"):
             return "You are not a Listener You cannot use this feature"
-        if cb is None:
-            return "lvotes are disabled in config, why are you even running this command...?"
-
-        temp = {}
-        for entry in cb:
-            try:
-                if cb["started_by"] == message.author.id:
-                    temp[entry] = cb[entry]
-            except KeyError as e:
-                temp[entry] = cb[entry]
 
-        for e in temp:
-            print("Deleted: " + str(self.config.doc["choppingBlock"][e]))
-            del self.config.doc["choppingBlock"][e]
+        for uid, entry in self.config.state.votes().items():
+            if entry.get("started_by", message.author.id) == message.author.id:
+                self.config.state.delete_vote(uid)
 
-        self.config.save()
         return "Deleted all lvotes if you had started any"
 
     async def lvalidate(self, message, user=None):
@@ -2457,8 +2487,6 @@ class Commands:
         !lvalidate <optional: tagged user>
         """
 
-        cb = self.config.get("choppingBlock")
-
         if "choppingBlock" not in self.config.doc:
             return "Unable to find the config object associated. You need to add choppingBlock: {} to your config..."
         if not self.check_user_has_role(message.author, "Listener"):
@@ -2474,12 +2502,13 @@ class Commands:
             if user is None:
                 return "No user found for that name, try again"
 
-        if user.id not in cb:
+        entry = self.config.state.get_vote(user.id)
+        if entry is None:
 
             return "That user is not in the list, therefore I can't do anything. Here's a cat though.\n" + await self.cat(message)
 
         else:
-            votelist = cb[user.id]["votes"]
+            votelist = entry["votes"]
             if len(votelist) < 2 :
                 return "Not enough votes to pass, cancel the poll or wait longer. You may cancel with " \
                        + self.config.prefix + "lcancel"
@@ -2501,16 +2530,16 @@ class Commands:
                         await self.client.send_message(message.author, user,
                                                        "Following a vote by the listeners: "
                                                        "you have been removed from helping hands for now")
-                        del self.config.doc["choppingBlock"][user.id]
-                        self.config.save()
+                        self.config.state.delete_vote(user.id)
                     except:
                         return "User could not be PM'd but they are a member of Helping Hands no more"
                     else:
                         return user.name + " has been removed from Helping Hands"
                 else:
-                    cb[user.id]["pending"] = True
-                    cb[user.id]["server_id"] = message.server.id
-                    cb[user.id]["channel_id"] = message.channel.id
+                    entry["pending"] = True
+                    entry["server_id"] = message.server.id
+                    entry["channel_id"] = message.channel.id
+                    self.config.state.put_vote(user.id, entry)
 
                     try:
                         mop= await self.client.send_message(message.author, user,
@@ -2538,8 +2567,7 @@ class Commands:
                                                        "Following a vote by your fellow Helping Handss,"
                                                        " you have been demoted for the time being.")
 
-                        del self.config.doc["choppingBlock"][user.id]
-                        self.config.save()
+                        self.config.state.delete_vote(user.id)
 
                     except:
                         return "User could not be PM'd but they are a Helping Hands no more"
@@ -2547,7 +2575,8 @@ class Commands:
                         return user.name + " has been removed from Helping Hands"
 
                 elif avg > 0.85:
-                    cb[user.id]["pending"] = True
+                    entry["pending"] = True
+                    self.config.state.put_vote(user.id, entry)
                     try:
                         await self.client.send_message(message.author, user,
                                                        "Following a vote by your fellow members you have been chosen "
@@ -2565,25 +2594,23 @@ class Commands:
         If you were voted to be a Helping Hands, running this command will accept the offer. Otherwise, run !Lreject
         !laccept
         """
-        cb = self.config.get("choppingBlock")
-
         if "choppingBlock" not in self.config.doc:
             return "Unable to find the config object associated. You need to add choppingBlock: {} to your config..."
         if not message.channel.is_private:
             return "You must reply only in PMs with petal. Not in a channel"
-        if message.author.id in cb:
-            if "pending" in cb[message.author.id]:
-                svr = self.client.get_server(cb[message.author.id]["server_id"])
+        entry = self.config.state.get_vote(message.author.id)
+        if entry is not None:
+            if "pending" in entry:
+                svr = self.client.get_server(entry["server_id"])
                 if svr is None:
-                    return "Error fetching server with ID: " + cb[message.author.id]["server_id"] + " ask who promoted you to do it manually"
+                    return "Error fetching server with ID: " + entry["server_id"] + " ask who promoted you to do it manually"
                 member = svr.get_member(message.author.id)
                 await self.client.add_roles(member,
                                                discord.utils.get(svr.roles,
                                                                  name="Helping Hands"))
 
-                chan = svr.get_channel(cb[message.author.id]["channel_id"])
-                del self.config.doc["choppingBlock"][message.author.id]
-                self.config.save()
+                chan = svr.get_channel(entry.get("channel_id"))
+                self.config.state.delete_vote(message.author.id)
                 if chan is None:
                    return "You will need to tell them you have accepted as I could not notify them"
                 else:
@@ -2598,17 +2625,16 @@ class Commands:
         If you were voted to be a Helping Hands, running this command will reject the offer.
         !lreject
         """
-        cb = self.config.get("choppingBlock")
-
         if "choppingBlock" not in self.config.doc:
             return "Unable to find the config object associated. You need to add choppingBlock: {} to your config..."
 
-        if message.author.id in cb:
-            if "pending" in cb[message.author.id]:
+        entry = self.config.state.get_vote(message.author.id)
+        if entry is not None:
+            if "pending" in entry:
 
-                    svr = self.client.get_server(cb[message.author.id]["server_id"])
+                    svr = self.client.get_server(entry["server_id"])
                     if svr is not None:
-                        chan = svr.get_channel(cb[message.author.id]["channel_id"])
+                        chan = svr.get_channel(entry.get("channel_id"))
                     else:
                         chan = None
                     if chan is None:
@@ -2617,8 +2643,7 @@ class Commands:
                         await self.client.send_message(message.author, chan,
                                                        "Just letting y'all know that " + message.author.name +
                                                        " has rejected their role")
-                    del self.config.doc["choppingBlock"][message.author.id]
-                    self.config.save()
+                    self.config.state.delete_vote(message.author.id)
                     return "You have rejected to join the helping hands. If this was on accident, let a listener know"
             else:
                 return "You don't have a pending invite to join the Helping Handss at this time"
@@ -2628,14 +2653,13 @@ class Commands:
        If you were voted to be a Helping Hands, running this command will reject the offer.
        !lreject
        """
-        cb = self.config.get("choppingBlock")
-
         if "choppingBlock" not in self.config.doc:
             return "Unable to find the config object associated. You need to add choppingBlock: {} to your config..."
 
         if not self.check_user_has_role(message.author, "Listener"):
             return "You are not a Listener. You cannot use this feature"
 
+        cb = self.config.state.votes()
         msg = ""
         for entry in cb:
             mem = self.get_member(message, entry)
@@ -2666,7 +2690,7 @@ class Commands:
                    "You can still use !osu <osu name> though"
 
 
-        self.db.update_member(message.author, {"osu": osu})
+        await self.db.update_member(message.author, {"osu": osu})
 
         return "You have set: " + osu + " as your preferred OSU account. " \
                                         "You can now run, !osu and it " \
@@ -2696,9 +2720,9 @@ class Commands:
                    "Contact your bot developer and tell them if you think" \
                    " this is an error"
 
-        self.db.add_member(member)
+        await self.db.add_member(member)
 
-        alias = self.db.get_attribute(member, "aliases")
+        alias = await self.db.get_attribute(member, "aliases")
         if len(alias) == 0:
             return "`This member has no aliases`"
         else:
@@ -2720,7 +2744,7 @@ class Commands:
         """
         if not self.level0(message.author):
             return "You must be the bot owner to perform this"
-        for i in self.db.void.find():
+        for i in await self.db.dump_void():
             try:
                 msg = "Number **" + str(i["number"]) + "**\n Author: " + i["author"] + "\nTime Uploaded: " + str(i["time"]) + "\nContent: "+ i["content"]
             except KeyError:
@@ -2742,19 +2766,19 @@ class Commands:
         """
         args = self.clean_input(message.content)
         if args[0] == "":
-            entry = self.db.get_attribute(message.author, "journal")
+            entry = await self.db.get_attribute(message.author, "journal")
             if entry is None:
                 return "*You peek into your own journal...*\n\n" + "But find nothing."
             return "*You peek into your own journal...*\n\nYou find:\n\n" + entry["content"]
 
         mem = self.get_member(message, args[0])
         if mem is not None:
-            entry = self.db.get_attribute(mem, "journal")
+            entry = await self.db.get_attribute(mem, "journal")
             if entry is None:
                 return "*You peek into {}'s journal...*\n\n".format(mem.name) + "But find nothing"
             return "*You peek into {}'s journal...*\n\nYou find:\n\n".format(mem.name) + entry["content"]
-        entry = self.db.update_member(message.author,
-                                      data={"journal": {"content": args[0], "time": str(dt.utcnow())}})
+        entry = await self.db.update_member(message.author,
+                                            data={"journal": {"content": args[0], "time": str(dt.utcnow())}})
 
         return "Your journal has been updated. Anyone can read it with " + message.author.mention
 
@@ -2800,7 +2824,10 @@ class Commands:
         except twitter.error.TwitterError as e:
             print("ex:" + str(e))
             headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_5) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/50.0.2661.102 Safari/537.36'}
-            res = requests.get("http://aws.random.cat/meow", headers=headers).json()["file"]
+            try:
+                res = (await pelican.get("http://aws.random.cat/meow", headers=headers)).json()["file"]
+            except (PelicanError, ValueError, KeyError):
+                res = "*hugs*"
             return "Oh :(. Im sorry to say that you've made a goof. As it turns out, we already retweeted this tweet. I'm sure the author would appreciate it if they knew you tried to retweet their post twice! It's gonna be ok though, we'll get through this. Hmmmm.....hold on, I have an idea.\n\n\nHere: " + res
         else:
             return "Successfully retweeted!"
@@ -2813,19 +2840,20 @@ class Commands:
         if not self.db.useDB:
             return "Sorry, datbase is not enabled..."
 
-        if self.db.get_attribute(message.author, "ac") is None:
-            self.db.update_member(message.author, {"ac":True}, 2)
+        ac = await self.db.get_attribute(message.author, "ac")
+        if ac is None:
+            await self.db.update_member(message.author, {"ac":True}, 2)
             return "Enabled Animal Crossing Endings..."
-        elif self.db.get_attribute(message.author, "ac"):
-            self.db.update_member(message.author, {"ac":False}, 2)
+        elif ac:
+            await self.db.update_member(message.author, {"ac":False}, 2)
             return "Disabled Animal Crossing Endings..."
         else:
-            self.db.update_member(message.author, {"ac":True}, 2)
+            await self.db.update_member(message.author, {"ac":True}, 2)
             return "Re-Enabled Animal Crossing Endings..."
 
-    def get_ac(self):
-        l = list(self.db.ac.find())
-        return l[random.randint(0, len(l) - 1)]["ending"]
+    async def get_ac(self):
+        l = await self.db.get_ac_endings()
+        return l[random.randint(0, len(l) - 1)]
 
 
     async def bugger(self, message):
@@ -2839,13 +2867,15 @@ class Commands:
             url = "https://api.trello.com/1/lists/{}/cards".format(self.config.get("trello")["list_id"])
             params = {"key": self.config.get("trello")["app_key"],
                       "token": self.config.get("trello")["token"]}
-            response = requests.request("GET", url, params=params)
+            response = await pelican.get(url, params=params)
 
         except KeyError as e:
             return "The trello keys are misconfigured, check your config file"
+        except PelicanError as e:
+            response = None
 
 
-        if response is None:
+        if response is None or not response.ok:
             return "Could not get cards for the list ID provided. Talk to your bot owner."
         r = response.json()
         nums = []
@@ -2868,14 +2898,47 @@ class Commands:
                   "key": self.config.get("trello")["app_key"],
                   "token": self.config.get("trello")["token"]}
 
-        response = requests.request("POST", url, params=params)
+        try:
+            response = await pelican.post(url, params=params)
+        except PelicanError as e:
+            response = None
 
-        if response is None:
+        if response is None or not response.ok:
             return "Could not create bug report. Talk to your bot owner."
 
         #print(str(response.text))
         return "Created bug report with ID: " + str(top)
 
+    async def remind(self, message):
+        """
+        Reminds you of something later, in the same channel
+        >remind <duration, e.g. 2h30m> | <what to remind you of>
+        """
+        if not self.db.useDB:
+            return "Sorry, datbase is not enabled..."
+        args = self.clean_input(message.content)
+        if len(args) < 2 or args[0] == '' or args[1] == '':
+            return ("Syntax: `" + self.config.prefix +
+                    "remind <duration> | <text>` e.g. `" +
+                    self.config.prefix + "remind 1h30m | stretch`")
+        seconds = self.parse_duration(args[0])
+        if seconds is None or seconds <= 0:
+            return ("I couldn't understand `" + args[0] +
+                    "`, try something like 45m, 2h or 1d12h")
+        if seconds > 366 * 86400:
+            return "That's over a year away, I might not be around by then"
+
+        content = " | ".join(args[1:])
+        if "@everyone" in content or "@here" in content:
+            return "Nice try, I'm not pinging everyone for your reminder"
+
+        due = time.time() + seconds
+        channel = None if message.channel.is_private else message.channel.id
+        await self.client.reminders.add(message.author, content, due, channel)
+        return ("Okay, I'll remind you at " +
+                dt.utcfromtimestamp(due).strftime("%Y-%m-%d %H:%M:%S") +
+                " UTC")
+
     async def tz(self, message):
         """
         >tz [0-23] or "now for UTC" | location or number adjustment (e.g. -6)
@@ -2919,7 +2982,7 @@ class Commands:
         now = dt.utcnow() + timedelta(hours=int(now) / 100)
 
 
-        self.db.update_member(message.author, {"tz": parsed.zone})
+        await self.db.update_member(message.author, {"tz": parsed.zone})
         em = discord.Embed(title="TimeZone Info for " + parsed.zone, color=0x00acff)
         em.add_field(name="Petal's UTC Time", value=str(dt.utcnow())[:-7])
         em.add_field(name="Input Time(" + input_p.zone + ")", value=str(localnow)[:-7], inline=False)
@@ -2951,10 +3014,10 @@ class Commands:
         """
         if not message.channel.is_private:
             return "you gotta use this in PMs 0,,0"
-        if self.db.dinos.find_one({"id":message.author.id}) is not None:
+        if await self.db.get_dino(message.author.id) is not None:
             return "Hey, thanks for another fact. but you can only vote once"
         else:
-            self.db.dinos.insert_one({"id":message.author.id, "name":message.author.name, "timestamp":str(dt.utcnow()),"fact":message.content})
+            await self.db.add_dino(message.author.id, message.author.name, message.content)
             return "Thanks! you are now entered in the giveaway"
 
 
@@ -2975,7 +3038,7 @@ class Commands:
         if submission == "":
             return "You need to include your Minecraft username, or I will not be able to find you! Like this: `!wlme Notch` :D"
 
-        reply, uuid = WLRequest(submission, message.author.id) # Send the submission through the new function
+        reply, uuid = await WLRequest(submission, message.author.id) # Send the submission through the new function
 
         if reply == 0:
 
@@ -2993,7 +3056,7 @@ class Commands:
         #elif reply == -:
             #return "Error (No Description Provided)"
         elif reply == -7:
-            return "Could not access the database file D:"
+            return "Could not access the database file D: (the bot log says why)"
         elif reply == -8:
             return "That does not seem to be a valid Minecraft username D: " + "DEBUG: " + submission
         elif reply == -9:
@@ -3017,7 +3080,7 @@ class Commands:
             return "This needs to be done in the right channel!"
 
         submission = message.content[len(self.config.prefix) + 2:].strip() # separated this for simplicity
-        reply, doSend, recipientid, mcname, wlwrite = WLAdd(submission, message.author.id) # Send the submission through the new function
+        reply, doSend, recipientid, mcname, wlwrite = await WLAdd(submission, message.author.id) # Send the submission through the new function
 
         if reply == 0:
             if doSend == True:
@@ -3061,23 +3124,17 @@ class Commands:
         submission = message.content[len(self.config.prefix) + 7:].strip() # separated this for simplicity
 
         if submission.lower() == "pending":
-            searchres = []
+            searchres = WLPending()
             noresult = "No requests are currently {}"
-            pList = WLDump()
-            for entry in pList:
-                if entry["approved"] == []:
-                    searchres.append(entry)
         elif submission.lower() == "suspended" or submission.lower() == "restricted":
-            searchres = []
+            searchres = WLSuspended()
             noresult = "No users are currently {}"
-            pList = WLDump()
-            for entry in pList:
-                if entry["suspended"] == True:
-                    searchres.append(entry)
         else:
             searchres = WLQuery(submission)
             noresult = "No database entries matching `{}` found"
 
+        if searchres == -7:
+            return "Could not access database file"
         if searchres == []:
             return noresult.format(submission.lower())
         else:
@@ -3118,7 +3175,7 @@ class Commands:
 
         submission = message.content[len(self.config.prefix) + 9:].strip() # separated this for simplicity
         await self.client.send_typing(mcchan)
-        refreshReturn = EXPORT_WHITELIST(True, True)
+        refreshReturn = await EXPORT_WHITELIST(True, True)
         refstat = ["Whitelist failed to refresh.", "Whitelist Fully Refreshed."]
 
         return refstat[refreshReturn]
@@ -3139,6 +3196,8 @@ class Commands:
 
         submission = message.content[len(self.config.prefix) + 6:].strip() # separated this for simplicity
         uList = WLDump()
+        if uList == -7:
+            return "Could not access the database file D:"
         idList = []
         for entry in uList:
             idList.append(entry["discord"])
@@ -3216,7 +3275,7 @@ class Commands:
                 return "Could you be more specific about whether you want to enable or disable their suspension?"
         """
 
-        rep, wlwin = WLSuspend(victim, interp)
+        rep, wlwin = await WLSuspend(victim, interp)
         codes = {0 : "Suspension successfully enabled", -1 : "Suspension successfully lifted",
                 -2 : "No Change: Already suspended", -3 : "No Change: Not suspended",
                 -7 : "No Change: Failed to write database", -8 : "No Change: Indexing failure",
@@ -1,12 +1,56 @@
+import atexit
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
 from ruamel import yaml
 from .grasslands import Peacock
+from .state import StateStore
+from .wordfilter import WordFilter
 from random import randint
 from datetime import datetime
 log = Peacock()
 
+# Permission level list names in config.yml: l0, l1, l2...
+LEVEL_KEY = re.compile(r"^l(\d+)$")
+
+
+class RoleGrant(namedtuple("RoleGrant",
+                           "chan pattern role_key response role")):
+    """
+    One compiled roleGrant rule. role stays None until the rule is bound to
+    a server, since the config only knows the role's id or name
+    """
+    __slots__ = ()
+
+    def bind(self, server):
+        """
+        :param server: discord.Server to resolve the role in
+        :return: a copy of the rule with role set, or None if not found
+        """
+        for r in server.roles:
+            if r.id == self.role_key or r.name == self.role_key:
+                return self._replace(role=r)
+        return self._replace(role=None)
+
 
 class Config(object):
-    def __init__(self):
+    path = "config.yml"
+
+    def __init__(self, autosave=True):
+        """
+        :param autosave: write changes in the background. Off in dev mode,
+            where only >save writes config.yml
+        """
+        self.autosave = autosave
+        self.dirty = False
+        self.saveLock = threading.Lock()
+        self.saveWake = threading.Condition(self.saveLock)
+        self.saveThread = None
+        self.saveStop = False
         try:
             with open('config.yml', 'r') as fp:
                 self.doc = yaml.load(fp, Loader=yaml.RoundTripLoader)
@@ -37,13 +81,12 @@ class Config(object):
             self.l2 = self.doc["level"]["l2"]
             self.l3 = self.doc["level"]["l3"]
             self.l4 = self.doc["level"]["l4"]
+            self.reindex()
             log.f("config", "Loaded Local Permissions")
             self.aliases = self.doc["aliases"]
             log.f("config", "Loaded Aliases")
             self.permitNSFW = self.doc["permitNSFW"]
             log.f("config", "Permiting NSFW Images: " + str(self.permitNSFW))
-            self.blacklist = self.doc["blacklist"]
-            log.f("config", "Loaded blacklist")
             self.commands = self.doc["commands"]
             log.f("config", "Loaded commands")
             self.useLog = "logChannel" in self.doc
@@ -53,7 +96,12 @@ class Config(object):
                 self.logChannel = self.get("logChannel")
                 self.modChannel = self.get("modChannel")
             self.wordFilter = self.get("wordFilter")
+            self.build_filter()
             log.f("config", "Loaded word filter")
+            self.build_role_grants()
+            log.f("config", "Loaded " + str(sum(map(len, self.roleGrants
+                                                   .values())))
+                  + " roleGrant rules")
             self.tc = self.get("trackChannel")
             if self.tc is None:
                 log.warn("trackChannel object not found in config.yml. " +
@@ -61,15 +109,74 @@ class Config(object):
 
             # self.lockLog = False  //deprecated
             # self.imageIndex = self.doc["imageIndex"]
-            self.hugDonors = self.doc["hugDonors"]
-            log.f("config", "Loaded hug donors")
-            self.stats = self.doc["stats"]
-            log.f("config", "Loaded stats")
+            self.state = StateStore(self.doc.get("stateFile", "state.db"))
+            self.state.import_config(self.doc)
+            log.f("config", "Loaded runtime state")
         except KeyError as e:
             log.err("Missing config item: " + str(e))
             exit(404)
         return
 
+    def reindex(self):
+        """
+        Builds the member id -> permission level lookup from the level lists.
+        Call it after changing them, a member listed twice keeps the higher
+        rank
+        """
+        levels = {}
+        for l, members in self.doc["level"].items():
+            match = LEVEL_KEY.match(str(l))
+            if match is None:
+                log.warn("Ignoring level list " + str(l)
+                         + ", level keys look like l1, l2...")
+                continue
+            rank = int(match.group(1))
+            for uid in members or []:
+                uid = str(uid)
+                levels[uid] = min(rank, levels.get(uid, rank))
+        self.levels = levels
+        return levels
+
+    def build_filter(self):
+        """
+        Compiles wordFilter into a WordFilter. wordFilterOptions may turn
+        off ignorecase, punctuation or leetspeak normalization
+        """
+        options = self.doc.get("wordFilterOptions") or {}
+        self.filter = WordFilter(self.wordFilter,
+                                 ignorecase=options.get("ignorecase", True),
+                                 punctuation=options.get("punctuation", True),
+                                 leetspeak=options.get("leetspeak", True))
+        return self.filter
+
+    def build_role_grants(self):
+        """
+        Compiles roleGrant into RoleGrant rules grouped by channel id.
+        roleGrant may be a single rule or a list of them
+        """
+        entries = self.doc.get("roleGrant") or []
+        if isinstance(entries, dict):
+            entries = [entries]
+        grants = {}
+        for entry in entries:
+            try:
+                flags = re.IGNORECASE if entry.get("ignorecase") else 0
+                rule = RoleGrant(chan=str(entry["chan"]),
+                                 pattern=re.compile(entry["regex"], flags),
+                                 role_key=str(entry["role"]),
+                                 response=entry.get("response"),
+                                 role=None)
+            except KeyError as e:
+                log.err("roleGrant rule is missing " + str(e))
+                continue
+            except re.error as e:
+                log.err("roleGrant regex " + str(entry.get("regex"))
+                        + " does not compile: " + str(e))
+                continue
+            grants[rule.chan] = grants.get(rule.chan, ()) + (rule,)
+        self.roleGrants = grants
+        return grants
+
     # def flip(self):
     #    self.lockLog = not self.lockLog
 
@@ -84,33 +191,147 @@ class Config(object):
                 return None
 
     def save(self, vb=False):
+        """
+        Marks the config dirty. The writer thread picks it up after
+        saveDebounce seconds of quiet, so a burst of changes is one write
+        :param vb: log that a save was queued
+        """
         if vb:
             log.info("Saving...")
+        with self.saveLock:
+            self.dirty = True
+            if not self.autosave or self.saveStop:
+                return
+            if self.saveThread is None or not self.saveThread.is_alive():
+                self.saveThread = threading.Thread(target=self.save_worker,
+                                                   name="config-writer",
+                                                   daemon=True)
+                self.saveThread.start()
+                atexit.register(self.close)
+            self.saveWake.notify()
+        return
+
+    def save_worker(self):
+        delay = self.doc.get("saveDebounce", 5)
+        while True:
+            with self.saveLock:
+                while not self.dirty and not self.saveStop:
+                    self.saveWake.wait()
+                # Keep waiting while changes are still coming in, but never
+                # hold a write back for more than ten debounce periods
+                deadline = time.monotonic() + delay * 10
+                while (not self.saveStop and time.monotonic() < deadline
+                       and self.saveWake.wait(delay)):
+                    pass
+                stop = self.saveStop
+            self.flush()
+            if stop:
+                return
+
+    def close(self, timeout=10):
+        """
+        Tells the writer thread to write what is pending and stop, then
+        waits for it. Only that thread writes, so nothing is written twice
+        or cut off at exit
+        """
+        with self.saveLock:
+            thread = self.saveThread
+            self.saveStop = True
+            self.saveWake.notify()
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+
+    def flush(self, vb=False):
+        """
+        Writes config.yml now if anything changed since the last write
+        :param vb: log the result
+        :return: True if the file was written
+        """
+        with self.saveLock:
+            if not self.dirty:
+                return False
+            self.dirty = False
         try:
-            with open('config.yml', 'w') as fp:
-                yaml.dump(self.doc, fp, Dumper=yaml.RoundTripDumper)
-        except PermissionError:
-            log.err("No write access to config.yml")
-        except IOError as e:
-            log.err("Could not open config.yml: " + str(e))
+            self.write(self.dump())
         except Exception as e:
-            log.err("An unexcpected exception of type: "
+            with self.saveLock:
+                self.dirty = True
+            log.err("Could not save config.yml, an exception of type: "
                     + type(e).__name__
-                    + "has occurred: " + str(e))
-        else:
-            if vb:
-                log.info("Save complete")
-        return
+                    + " has occurred: " + str(e))
+            return False
+        if vb:
+            log.info("Save complete")
+        return True
+
+    def dump(self, attempts=5):
+        """
+        Serializes the doc. The event loop may change it mid dump, which
+        raises RuntimeError, so that is retried
+        """
+        for attempt in range(attempts):
+            buf = io.StringIO()
+            try:
+                yaml.dump(self.doc, buf, Dumper=yaml.RoundTripDumper)
+            except RuntimeError:
+                if attempt == attempts - 1:
+                    raise
+            else:
+                return buf.getvalue()
+
+    def write(self, text):
+        """
+        Atomically replaces config.yml, a crash mid write leaves the old
+        file intact
+        """
+        folder = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".config.", suffix=".yml",
+                                   dir=folder)
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(text)
+                fp.flush()
+                os.fsync(fp.fileno())
+            if os.path.exists(self.path):
+                os.chmod(tmp, os.stat(self.path).st_mode & 0o777)
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
 
     def load(self, vb=False):
         try:
             with open('config.yml', 'r') as fp:
                 self.doc = yaml.load(fp, Loader=yaml.RoundTripLoader)
+            self.refresh()
         except IOError as e:
             log.err("Could not open config.yml: " + str(e))
+        except KeyError as e:
+            log.err("Missing config item: " + str(e))
         except Exception as e:
             log.err("An unexcpected exception of type: "
                     + type(e).__name__
                     + "has occurred: " + str(e))
         else:
             return self
+
+    def refresh(self):
+        """
+        Points the shortcut attributes at the current doc. Needed after
+        load() replaces the doc, otherwise they keep the old values
+        """
+        self.prefix = self.doc["prefix"]
+        self.owner = self.doc["owner"]
+        self.pm = self.doc["acceptPMs"]
+        self.l1 = self.doc["level"]["l1"]
+        self.l2 = self.doc["level"]["l2"]
+        self.l3 = self.doc["level"]["l3"]
+        self.l4 = self.doc["level"]["l4"]
+        self.reindex()
+        self.aliases = self.doc["aliases"]
+        self.permitNSFW = self.doc["permitNSFW"]
+        self.commands = self.doc["commands"]
+        self.wordFilter = self.get("wordFilter")
+        self.build_filter()
+        self.build_role_grants()
@@ -1,7 +1,13 @@
 # 2017 John Shell
+import asyncio
 import discord
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from random import randint as rand
 import pytz
 
 from .grasslands import Peacock
@@ -39,6 +45,355 @@ def ts(dt):
         return dt
 
 
+def new_member_doc(member):
+    """
+    Builds the default document stored for a member seen for the first time
+    :param member: discord.Member or discord.User
+    :return: dict member
+    """
+    data = {"name": member.name,
+            "uid": member.id,
+            "discord_date": ts(member.created_at),
+            "local_date": ts(datetime.utcnow()),
+            "aliases": [],
+            "servers": [],
+            "discriminator": member.discriminator,
+            "isBot": member.bot,
+            "avatar_url": member.avatar_url,
+            "location": "Brisbane, Australia",
+            "osu": "",
+            "banned": False,
+            "subreddit": "aww",
+            "message_count": 0,
+            "last_active": ts(datetime.utcnow()),
+            "last_message": 0,
+            "last_message_channel": '0',
+            "strikes": [],
+            "subscriptions": [],
+            "commands_count": 0}
+    if isinstance(member, discord.Member):
+        data["servers"].append(member.server.id)
+        data["server_date"] = ts(member.joined_at)
+        data["joins"] = [ts(member.joined_at)]
+    if member.display_name != member.name:
+        data["aliases"].append(member.display_name)
+    return data
+
+
+# Member fields stored as arrays. Values given for these are added to the set
+# rather than replacing it
+LIST_FIELDS = ("aliases", "servers", "strikes", "subscriptions", "joins")
+
+
+def add_insert_defaults(member, update):
+    """
+    Adds a $setOnInsert of the default member document to an update so it
+    can upsert members that have never been seen before. Fields already
+    touched by another operator are left out, mongo refuses the conflict
+    :param member: discord.Member or discord.User
+    :param update: update document, modified in place
+    :return: update
+    """
+    touched = set()
+    for op in update:
+        touched.update(update[op])
+    defaults = {k: v for k, v in new_member_doc(member).items()
+                if k not in touched}
+    if len(defaults) > 0:
+        update["$setOnInsert"] = defaults
+    return update
+
+
+def member_update(member, data, type=0):
+    """
+    Translates an update_member data dict into a single mongo update
+    document, so it can be applied server side without reading the member
+    :param member: discord.Member or str id of member
+    :param data: dictionary containing data to update
+    :param type: 0 = None, 1 = Message, 2 = Command
+    :return: dict update document
+    """
+    update = {}
+    for key in data:
+        value = data[key]
+        if isinstance(value, dict):
+            update.setdefault("$set", {})[key] = {k: ts(v) for k, v
+                                                  in value.items()}
+        elif key in LIST_FIELDS:
+            if not isinstance(value, list):
+                value = [value]
+            update.setdefault("$addToSet", {})[key] = {"$each": value}
+        else:
+            update.setdefault("$set", {})[key] = ts(value)
+
+    if type == 1:
+        update.setdefault("$inc", {})["message_count"] = 1
+    elif type == 2:
+        update.setdefault("$inc", {})["commands_count"] = 1
+
+    if isinstance(member, discord.Member) or isinstance(member, discord.User):
+        add_insert_defaults(member, update)
+    return update
+
+
+# Indexes DBHandler relies on, created at startup if missing.
+# (collection, [(field, direction)], create_index options)
+INDEXES = [
+    ("members", [("uid", 1)], {"unique": True}),
+    ("void", [("number", 1)], {}),
+    ("void", [("hash", 1)], {"unique": True, "sparse": True}),
+    ("motd", [("used", 1), ("approved", 1)], {}),
+    ("motd", [("num", -1)], {}),
+    ("subs", [("code", 1)], {"unique": True}),
+    ("subs", [("name", 1)], {}),
+    ("subs", [("members", 1)], {}),
+    ("reminders", [("ts", 1)], {}),
+    ("dinos", [("id", 1)], {}),
+    ("bans", [("expires", 1)], {}),
+    ("bans", [("uid", 1), ("server", 1)], {"unique": True}),
+    ("notifications", [("code", 1), ("ts", -1)], {}),
+]
+
+# Shapes of the queries made by DBHandler, checked by explain_queries()
+# (collection, filter, sort)
+QUERY_SHAPES = [
+    ("members", {"uid": "0"}, None),
+    ("void", {"number": 0}, None),
+    ("void", {"hash": ""}, None),
+    ("motd", {"used": False, "approved": True}, None),
+    ("motd", {}, [("num", -1)]),
+    ("motd", {"num": 0}, None),
+    ("subs", {"code": ""}, None),
+    ("subs", {"name": ""}, None),
+    ("subs", {"members": ""}, None),
+    ("reminders", {"ts": {"$lte": 0, "$gt": 0}}, [("ts", 1)]),
+    ("dinos", {"id": ""}, None),
+    ("bans", {}, [("expires", 1)]),
+    ("bans", {"uid": "", "server": ""}, None),
+]
+
+
+def void_hash(content):
+    """
+    Hash of a void submission, ignoring case and whitespace differences
+    :param content: str submission
+    :return: str hex digest
+    """
+    normalized = " ".join(content.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def plan_stages(plan):
+    """
+    Walks a query plan from explain() and yields every stage name in it
+    :param plan: winningPlan dict
+    """
+    yield plan.get("stage")
+    if "inputStage" in plan:
+        yield from plan_stages(plan["inputStage"])
+    for stage in plan.get("inputStages", []):
+        yield from plan_stages(stage)
+
+
+class MemberCache(object):
+    """
+    Bounded LRU cache of member documents. Entries expire after ttl seconds
+    and are dropped by any write made through DBHandler. An entry is either
+    a whole document or the fields fetched for it so far. hits and misses
+    are counted so the size can be tuned against the member count
+    """
+    def __init__(self, size=1000, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid, key=None):
+        """
+        :param key: field wanted, None for the whole document
+        :return: cached document, None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(uid)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[uid]
+                entry = None
+            fields = None if entry is None else entry[2]
+            if entry is None or (fields is not None
+                                 and (key is None or key not in fields)):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(uid)
+            self.hits += 1
+            return entry[1]
+
+    def token(self):
+        """
+        Take before reading from the database and hand to put(), so a read
+        that raced with a write is not cached
+        """
+        return self.writes
+
+    def put(self, uid, doc, token, key=None):
+        """
+        :param key: the single field doc was projected to, None if doc is
+            the whole document
+        """
+        with self.lock:
+            if token != self.writes:
+                return
+            if key is None:
+                self.entries[uid] = (time.monotonic(), doc, None)
+            else:
+                entry = self.entries.get(uid)
+                if entry is not None and entry[2] is None:
+                    return
+                if entry is not None \
+                        and time.monotonic() - entry[0] <= self.ttl:
+                    merged = dict(entry[1])
+                    merged.update(doc)
+                    self.entries[uid] = (entry[0], merged,
+                                         entry[2] | {key})
+                else:
+                    self.entries[uid] = (time.monotonic(), dict(doc), {key})
+            self.entries.move_to_end(uid)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *uids):
+        with self.lock:
+            self.writes += 1
+            for uid in uids:
+                self.entries.pop(uid, None)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self.entries), "max": self.size}
+
+
+class ActivityBuffer(object):
+    """
+    Write-behind buffer for per-message member activity. Every message
+    folds into a single pending delta per member which is written out with
+    one bulk write when flush() is called (on an interval, or once the
+    buffer holds too many members)
+    """
+    def __init__(self, collection, size=200, cache=None):
+        self.collection = collection
+        self.cache = cache
+        self.size = size
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def record(self, member, data, type=0):
+        """
+        Folds activity into the pending delta for member
+        :param member: discord.Member or discord.User
+        :param data: dict of fields, str values are added to list fields
+        :param type: 0 = None, 1 = Message, 2 = Command
+        :return: bool buffer is full and should be flushed
+        """
+        with self.lock:
+            delta = self.pending.get(member.id)
+            if delta is None:
+                delta = {"member": member, "set": {}, "add": {}, "inc": {}}
+                self.pending[member.id] = delta
+
+            delta["member"] = member
+            for key in data:
+                if key in LIST_FIELDS:
+                    items = delta["add"].setdefault(key, [])
+                    if data[key] not in items:
+                        items.append(data[key])
+                else:
+                    delta["set"][key] = ts(data[key])
+
+            if type == 1:
+                delta["inc"]["message_count"] = \
+                    delta["inc"].get("message_count", 0) + 1
+            elif type == 2:
+                delta["inc"]["commands_count"] = \
+                    delta["inc"].get("commands_count", 0) + 1
+
+            return len(self.pending) >= self.size
+
+    def restore(self, deltas):
+        """
+        Merges deltas that failed to write back under anything buffered
+        since, so nothing is lost and the next flush retries them
+        :param deltas: dict uid -> delta
+        """
+        with self.lock:
+            for uid, old in deltas.items():
+                new = self.pending.get(uid)
+                if new is None:
+                    self.pending[uid] = old
+                    continue
+                for key, value in old["set"].items():
+                    new["set"].setdefault(key, value)
+                for key, items in old["add"].items():
+                    merged = new["add"].setdefault(key, [])
+                    for item in items:
+                        if item not in merged:
+                            merged.append(item)
+                for key, count in old["inc"].items():
+                    new["inc"][key] = new["inc"].get(key, 0) + count
+
+    def flush(self):
+        """
+        Writes every pending delta with a single unordered bulk write. If
+        the write fails the deltas that didn't make it are put back
+        :return: int number of members written
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+        if len(pending) == 0:
+            return 0
+
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        uids = list(pending)
+        ops = []
+        for uid in uids:
+            delta = pending[uid]
+            update = {}
+            if delta["set"]:
+                update["$set"] = delta["set"]
+            if delta["add"]:
+                update["$addToSet"] = {k: {"$each": v}
+                                       for k, v in delta["add"].items()}
+            if delta["inc"]:
+                update["$inc"] = delta["inc"]
+            add_insert_defaults(delta["member"], update)
+            ops.append(UpdateOne({"uid": uid}, update, upsert=True))
+
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            # Unordered, so every op not listed in writeErrors was applied.
+            # Only the failed ones go back, or their $inc would count twice
+            failed = {uids[err["index"]]
+                      for err in e.details.get("writeErrors", [])}
+            self.restore({uid: pending[uid] for uid in failed})
+            if self.cache is not None:
+                self.cache.invalidate(*pending.keys())
+            raise
+        except Exception:
+            self.restore(pending)
+            raise
+        if self.cache is not None:
+            self.cache.invalidate(*pending.keys())
+        return len(ops)
+
+
 class DBHandler(object):
     """
     Handle connections between leaf and the database. If config.yml has
@@ -77,8 +432,113 @@ class DBHandler(object):
         self.subs = self.db["subs"]
         self.emoji = self.db["emoji"]
         self.dinos = self.db["dinos"]
+        self.counters = self.db["counters"]
+        self.bans = self.db["bans"]
+        self.notifications = self.db["notifications"]
+        self.cache = MemberCache(db_conf.get("cacheSize", 1000),
+                                 db_conf.get("cacheTTL", 300))
+        self.activity = ActivityBuffer(self.members,
+                                       db_conf.get("flushSize", 200),
+                                       self.cache)
+        self.ensure_indexes()
+        self.seed_counters()
+        self.backfill_void_hashes()
+        self.migrate_bans()
+        if db_conf.get("explain", False):
+            for line in self.explain_queries():
+                log.warn("DBHandler: " + line)
         log.f("DBHandler", "Database system ready")
 
+    def ensure_indexes(self):
+        """
+        Creates every index in INDEXES that doesn't exist yet. Failures
+        (e.g. duplicate uids blocking a unique index) are logged, not raised
+        """
+        from pymongo.errors import PyMongoError
+        for collection, keys, options in INDEXES:
+            try:
+                self.db[collection].create_index(keys, background=True,
+                                                 **options)
+            except PyMongoError as e:
+                log.err("Could not create index " + str(keys) + " on "
+                        + collection + ": " + str(e))
+
+    def seed_counters(self):
+        """
+        Makes sure the void counter starts past the highest number already
+        used. $max keeps this safe to run on every startup. Entries saved
+        without a number (petal stopped between the insert and numbering
+        it) get one here
+        """
+        top = self.void.find_one({"number": {"$exists": True}},
+                                 sort=[("number", -1)])
+        seq = -1 if top is None else top["number"]
+        self.counters.update_one({"_id": "void"}, {"$max": {"seq": seq}},
+                                 upsert=True)
+        for entry in self.void.find({"number": {"$exists": False}},
+                                    {"_id": 1}):
+            self.void.update_one({"_id": entry["_id"]},
+                                 {"$set": {"number": self.next_void_number()}})
+
+    def backfill_void_hashes(self):
+        """
+        Adds content hashes to void entries saved before hashing existed.
+        Entries that collide with an existing hash are duplicates. They are
+        left without one and marked so later startups don't retry them
+        """
+        from pymongo.errors import DuplicateKeyError
+        count = 0
+        for entry in self.void.find({"hash": {"$exists": False},
+                                     "duplicate": {"$exists": False}},
+                                    {"content": 1}):
+            try:
+                self.void.update_one({"_id": entry["_id"]},
+                                     {"$set": {"hash": void_hash(entry["content"])}})
+            except DuplicateKeyError:
+                self.void.update_one({"_id": entry["_id"]},
+                                     {"$set": {"duplicate": True}})
+                continue
+            count += 1
+        if count > 0:
+            log.f("DBHandler", "Hashed " + str(count) + " void entries")
+
+    def migrate_bans(self):
+        """
+        Moves tempban expiries kept on member documents (banExpires) into
+        the bans collection
+        """
+        count = 0
+        for member in self.members.find({"banExpires": {"$exists": True}},
+                                        {"uid": 1, "bannedFrom": 1,
+                                         "banExpires": 1}):
+            if member.get("bannedFrom") is not None:
+                self.add_ban(member["uid"], member["bannedFrom"],
+                             int(float(member["banExpires"])))
+                count += 1
+            self.members.update_one({"_id": member["_id"]},
+                                    {"$unset": {"banExpires": ""}})
+        if count > 0:
+            log.f("DBHandler", "Moved " + str(count) + " tempbans")
+
+    def explain_queries(self):
+        """
+        Runs explain on every shape in QUERY_SHAPES
+        :return: list of str, one per query that still scans a collection
+        """
+        report = []
+        for collection, query, sort in QUERY_SHAPES:
+            cursor = self.db[collection].find(query).limit(1)
+            if sort is not None:
+                cursor = cursor.sort(sort)
+            plan = cursor.explain()["queryPlanner"]["winningPlan"]
+            if "COLLSCAN" in plan_stages(plan):
+                report.append(collection + " " + str(query)
+                              + (" sort " + str(sort) if sort else "")
+                              + " does a full collection scan")
+        if len(report) == 0:
+            log.f("DBHandler", "Every query shape is using an index")
+        return report
+
     def member_exists(self, member):
         """
         :param member: id of member to look up
@@ -100,49 +560,31 @@ class DBHandler(object):
             return False
 
         else:
-
-            data = {"name": member.name,
-                    "uid": member.id,
-                    "discord_date": ts(member.created_at),
-                    "local_date": ts(datetime.utcnow()),
-                    "aliases": [],
-                    "servers": [member.server.id],
-                    "discriminator": member.discriminator,
-                    "isBot": member.bot,
-                    "avatar_url": member.avatar_url,
-                    "location": "Brisbane, Australia",
-                    "osu": "",
-                    "banned": False,
-                    "subreddit": "aww",
-                    "message_count": 0,
-                    "last_active": ts(datetime.utcnow()),
-                    "last_message": 0,
-                    "last_message_channel": '0',
-                    "strikes": [],
-                    "subscriptions": [],
-                    "commands_count": 0}
-            if isinstance(member, discord.Member):
-                data["server_date"] = ts(member.joined_at)
-                data["joins"] =  [ ts(member.joined_at) ]
-            if member.display_name != member.name:
-                data["aliases"].append(member.display_name)
-
+            data = new_member_doc(member)
             pid = self.members.insert_one(data).inserted_id
+            self.cache.invalidate(member.id)
             if verbose:
                 log.f("DBhandler", "New member added to DB! (_id: " + str(pid) + ")")
             return True
 
     def get_member(self, member):
         """
-        Retrieves a Dictionary representation of a member
+        Retrieves a Dictionary representation of a member. Served from the
+        member cache when possible
         :param member: discord.Member or str id of member
         :return: dict member
         """
         if not self.useDB:
             return False
-        r = self.members.find_one({"uid": m2id(member)})
+        uid = m2id(member)
+        r = self.cache.get(uid)
         if r is not None:
             return r
+        token = self.cache.token()
+        r = self.members.find_one({"uid": uid})
+        if r is not None:
+            self.cache.put(uid, r, token)
+            return r
         return None
 
     def get_attribute(self, member, key, verbose=True):
@@ -155,7 +597,14 @@ class DBHandler(object):
         """
         if not self.useDB:
             return False
-        mem = self.get_member(member)
+        uid = m2id(member)
+        mem = self.cache.get(uid, key)
+        if mem is None:
+            # Only the wanted field is fetched, and cached for next time
+            token = self.cache.token()
+            mem = self.members.find_one({"uid": uid}, {key: 1})
+            if mem is not None:
+                self.cache.put(uid, mem, token, key)
         if mem is None:
             if verbose:
                 log.f("DBHandler",   member.name + m2id(member) + " not found in db")
@@ -170,12 +619,16 @@ class DBHandler(object):
 
     def update_member(self, member, data=None, type=0):
         """
-        Updates a the database with keys and values provided in the data field
+        Updates a the database with keys and values provided in the data field.
+        The whole update is applied server side in one round trip: plain
+        values are $set, values for list fields are $addToSet and the
+        message/command counters are $inc'd. Members that aren't stored yet
+        are created with the default fields
 
         :param member: member to update
         :param data: dictionary containing data to update
         :param type: 0 = None, 1 = Message, 2 = Command
-        :return: str response
+        :return: bool member was updated
         """
         if not self.useDB:
             return False
@@ -183,96 +636,160 @@ class DBHandler(object):
         if data is None:
             log.f("DBhandler", "Please provide data first!")
             return False
-        if not self.member_exists(member):
-            self.add_member(member)
 
-        mem = self.get_member(member)
-        if mem is None:
+        update = member_update(member, data, type)
+        if len(update) == 0:
+            return True
+
+        result = self.members.update_one({"uid": m2id(member)}, update,
+                                         upsert="$setOnInsert" in update)
+        self.cache.invalidate(m2id(member))
+        if result.matched_count == 0 and result.upserted_id is None:
             log.f("DBhandler", "Member doesn't exist")
             return False
 
-        # TODO: get member dict first then query over. Update finally
-        count = 0
-
-        for key in data:
-            if isinstance(data[key], dict):
-                print(str(key) + "\n" + str(data) + "\n")
-                mem[key] = data[key]
-                print(str(mem[key]))
-                for vk in mem[key]:
-                    mem[key][vk] = ts(mem[key][vk])
-
-            elif key in mem:
-                if isinstance(mem[key], list):
-                    if isinstance(data[key], list):
-                        for item in data[key]:
-                            # log.f("DBHandler", "Item: " + item)
-                            if item not in mem[key]:
-                               #  log.f("DBHandler", "ON key: " + key + " added " + item + " to " + str(mem[key]))
-                                mem[key].append(item)
-                                count += 1
-                    else:
-                        if data[key] not in mem[key]:
-                            mem[key].append(data[key])
-                            log.f("DBHandler", "added " + data[key] + " to " + key )
-                            count += 1
+        return True
 
-                else:
-                    # log.f("DBHandler", "replace key: " + key + " -> "
-                    #  + str(mem[key]) + " with "
-                    #      + str(data[key]))
-                    # log.f("Replaced " + key + ": " + str(mem[key]) + " -> " + str(ts(data[key])))
-                    mem[key] = ts(data[key])
+    def record_activity(self, member, data, type=0):
+        """
+        Buffers message/command activity for a member instead of writing it
+        straight away. Flushes immediately if the buffer is full
 
+        :param member: member the activity belongs to
+        :param data: dictionary of activity fields
+        :param type: 0 = None, 1 = Message, 2 = Command
+        :return: bool activity was buffered
+        """
+        if not self.useDB:
+            return False
+        if self.activity.record(member, data, type):
+            self.flush_activity()
+        return True
 
+    def flush_activity(self):
+        """
+        Writes all buffered member activity to the database
+        :return: int number of members written
+        """
+        if not self.useDB:
+            return 0
+        try:
+            return self.activity.flush()
+        except Exception as e:
+            log.err("Could not flush member activity: " + str(e))
+            return 0
 
-            else:
-                # log.f("Added " + key)
-                mem[key] = ts(data[key])
-                count += 1
+    def cache_stats(self):
+        """
+        :return: dict hits, misses and size of the member cache
+        """
+        if not self.useDB:
+            return None
+        return self.cache.stats()
 
-        if type == 1:
-            mem["message_count"] += 1
-        elif type == 2:
-            mem["commands_count"] += 1
+    def get_void(self):
+        """
+        Picks a random entry from the void with a single server side $sample,
+        no matter how many numbers have been deleted. An entry that is still
+        waiting for its number is skipped by sampling again
+        :return: dict void entry or None if the void is empty
+        """
+        for attempt in range(3):
+            response = next(self.void.aggregate([{"$sample": {"size": 1}}]),
+                            None)
+            if response is None or "number" in response:
+                return response
+        return None
 
-        if count > 0:
-            log.f("DBHandler", "Added "  + str(count) + " fields to "
-                  + mem["name"])
+    def next_void_number(self):
+        """
+        Atomically allocates the next void number from the counter document
+        :return: int number
+        """
+        from pymongo import ReturnDocument
+        counter = self.counters.find_one_and_update(
+            {"_id": "void"}, {"$inc": {"seq": 1}}, upsert=True,
+            return_document=ReturnDocument.AFTER)
+        return counter["seq"]
 
-        self.members.replace_one({"uid": m2id(member)}, mem, upsert=False)
+    def save_void(self, content, name, id):
+        """
+        Saves a submission to the void. The insert either succeeds or is
+        rejected by the unique index on the content hash, and a number is
+        only allocated once it has succeeded, so duplicates never use one up
+        :return: int number of the new entry or None if it was a duplicate
+        """
+        from pymongo.errors import DuplicateKeyError
+        try:
+            pid = self.void.insert_one({"content": content,
+                                        "hash": void_hash(content),
+                                        "author": name + " " + id}).inserted_id
+        except DuplicateKeyError:
+            return None
+        number = self.next_void_number()
+        self.void.update_one({"_id": pid}, {"$set": {"number": number}})
+        return number
 
-        return True
+    def delete_void(self, number):
+        return self.void.delete_one({"number": number})
 
-    def get_void(self):
-        void_size = self.void.count()
-        if void_size == 0:
-            return "Nothing in void storage"
+    def count_void(self):
+        return self.void.count()
 
-        response = None
-        while response is None:
-            index = rand(0, void_size - 1)
-            response = self.void.find_one({"number": index})
+    def dump_void(self):
+        return list(self.void.find())
 
-        return response
+    def get_reminders(self, timestamp, after=None):
+        """
+        :param timestamp: datetime or unix timestamp, latest due time to get
+        :param after: only get reminders due later than this
+        :return: cursor over the reminders, soonest first
+        """
+        window = {"$lte": ts(timestamp)}
+        if after is not None:
+            window["$gt"] = ts(after)
+        return self.reminders.find({"ts": window}).sort("ts", 1)
 
-    def save_void(self, content, name, id):
-        if self.void.count({"content" : content}) > 0:
-            return None
+    def add_reminder(self, author, content, timestamp, channel=None):
+        """
+        :param author: member to remind
+        :param content: str what to remind them of
+        :param timestamp: datetime or unix timestamp it is due
+        :param channel: id of the channel to remind them in, None for a PM
+        :return: the stored reminder
+        """
+        doc = {"ts": ts(timestamp), "author": m2id(author),
+               "channel": channel, "content": content,
+               "created": time.time()}
+        self.reminders.insert_one(doc)
+        return doc
 
-        self.void.insert({"content": content, "number": self.void.count(), "author": name + " " + id})
-        return self.void.count()
+    def delete_reminders(self, ids):
+        """
+        :param ids: list of reminder _ids
+        """
+        return self.reminders.delete_many({"_id": {"$in": list(ids)}})
 
-    def delete_void(self, number):
-        return self.void.delete_one({"number": number})
+    def add_ban(self, uid, server, expires):
+        """
+        Records (or moves) when a tempban runs out
+        :param uid: str banned user id
+        :param server: str server id
+        :param expires: unix timestamp
+        """
+        doc = {"uid": uid, "server": server, "expires": int(expires)}
+        self.bans.update_one({"uid": uid, "server": server}, {"$set": doc},
+                             upsert=True)
+        return doc
 
-    def get_reminders(self, timestamp):
-        timestamp = ts(timestamp)
-        return self.reminders.find({"ts": {"$lr": timestamp}})
+    def delete_ban(self, uid, server):
+        return self.bans.delete_one({"uid": uid, "server": server})
 
-    def add_reminder(self, author, content, timestamp):
-        timestamp = ts(timestamp)
-        return self.reminders.insert_one({"ts": timestamp, "author": author.id, "content": content})
+    def get_bans(self):
+        """
+        :return: list of every pending tempban, soonest first
+        """
+        return list(self.bans.find({}, {"_id": 0}).sort("expires", 1))
 
     def get_motd_entry(self, update=False):
         response = self.motd.find_one({"used": False, "approved": True})
@@ -311,3 +828,227 @@ class DBHandler(object):
                                  upsert=False)
 
         return self.motd.find_one({"num": num})
+
+    def count_motd(self):
+        return self.motd.count({"approved": True, "used": False})
+
+    def get_sub(self, code):
+        return self.subs.find_one({"code": code})
+
+    def get_sub_by_name(self, name):
+        return self.subs.find_one({"name": name})
+
+    def get_subs(self):
+        """
+        :return: list of every sub, without their member lists
+        """
+        return list(self.subs.find({}, {"members": 0}))
+
+    def add_sub(self, name, code):
+        return self.subs.insert_one({"name": name, "code": code, "members": []})
+
+    def delete_sub(self, code):
+        return self.subs.delete_one({"code": code})
+
+    def change_sub_member(self, code, uid, op):
+        """
+        Adds or removes one member in a single update. Only the sub's name
+        and whether uid was already a member come back, never the member list
+        :param code: sub code
+        :param uid: str member id
+        :param op: "$addToSet" or "$pull"
+        :return: (sub, was_member) or (None, False) if the sub doesn't exist
+        """
+        from pymongo import ReturnDocument
+        sub = self.subs.find_one_and_update(
+            {"code": code}, {op: {"members": uid}},
+            projection={"name": 1, "code": 1,
+                        "members": {"$elemMatch": {"$eq": uid}}},
+            return_document=ReturnDocument.BEFORE)
+        if sub is None:
+            return None, False
+        return sub, bool(sub.pop("members", None))
+
+    def subscribe(self, code, uid):
+        return self.change_sub_member(code, uid, "$addToSet")
+
+    def unsubscribe(self, code, uid):
+        return self.change_sub_member(code, uid, "$pull")
+
+    def get_member_subs(self, uid):
+        """
+        :param uid: str member id
+        :return: list of the subs uid is in, without their member lists
+        """
+        return list(self.subs.find({"members": uid}, {"members": 0})
+                    .sort("name", 1))
+
+    def record_notification(self, code, author, outcomes):
+        """
+        Stores who a sub's event notification reached
+        :param code: sub code
+        :param author: member who posted the event
+        :param outcomes: dict of member id -> sent/blocked/missing/failed
+        """
+        counts = {}
+        for outcome in outcomes.values():
+            counts[outcome] = counts.get(outcome, 0) + 1
+        doc = {"code": code, "author": m2id(author), "ts": time.time(),
+               "counts": counts,
+               "outcomes": [{"uid": uid, "outcome": outcome}
+                            for uid, outcome in outcomes.items()]}
+        self.notifications.insert_one(doc)
+        return doc
+
+    def get_ac_endings(self):
+        return [entry["ending"] for entry in self.ac.find()]
+
+    def get_dino(self, uid):
+        return self.dinos.find_one({"id": uid})
+
+    def add_dino(self, uid, name, fact):
+        return self.dinos.insert_one({"id": uid, "name": name,
+                                      "timestamp": str(datetime.utcnow()),
+                                      "fact": fact})
+
+
+class AsyncDBHandler(object):
+    """
+    Awaitable front end for DBHandler. Every call is handed to a small
+    thread pool so a slow database never stalls the discord event loop.
+    The wrapped DBHandler is still available as .sync
+    """
+    def __init__(self, db):
+        self.sync = db
+        self.useDB = db.useDB
+        workers = 1
+        if db.useDB:
+            workers = db.config.get("dbconf").get("workers", 4)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) on the database thread pool
+        :return: asyncio.Future with the result of func
+        """
+        return asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    async def member_exists(self, member):
+        return await self.run(self.sync.member_exists, member)
+
+    async def add_member(self, member, verbose=False):
+        return await self.run(self.sync.add_member, member, verbose)
+
+    async def get_member(self, member):
+        return await self.run(self.sync.get_member, member)
+
+    async def get_attribute(self, member, key, verbose=True):
+        return await self.run(self.sync.get_attribute, member, key, verbose)
+
+    async def update_member(self, member, data=None, type=0):
+        return await self.run(self.sync.update_member, member, data, type)
+
+    async def record_activity(self, member, data, type=0):
+        """
+        Buffers member activity. Only touches the database (on the thread
+        pool) when the buffer is full
+        """
+        if not self.useDB:
+            return False
+        if self.sync.activity.record(member, data, type):
+            await self.flush_activity()
+        return True
+
+    async def flush_activity(self):
+        return await self.run(self.sync.flush_activity)
+
+    def cache_stats(self):
+        return self.sync.cache_stats()
+
+    async def get_void(self):
+        return await self.run(self.sync.get_void)
+
+    async def save_void(self, content, name, id):
+        return await self.run(self.sync.save_void, content, name, id)
+
+    async def delete_void(self, number):
+        return await self.run(self.sync.delete_void, number)
+
+    async def count_void(self):
+        return await self.run(self.sync.count_void)
+
+    async def dump_void(self):
+        return await self.run(self.sync.dump_void)
+
+    async def get_reminders(self, timestamp, after=None):
+        return await self.run(
+            lambda: list(self.sync.get_reminders(timestamp, after)))
+
+    async def add_reminder(self, author, content, timestamp, channel=None):
+        return await self.run(self.sync.add_reminder, author, content,
+                              timestamp, channel)
+
+    async def delete_reminders(self, ids):
+        return await self.run(self.sync.delete_reminders, ids)
+
+    async def add_ban(self, uid, server, expires):
+        return await self.run(self.sync.add_ban, uid, server, expires)
+
+    async def delete_ban(self, uid, server):
+        return await self.run(self.sync.delete_ban, uid, server)
+
+    async def get_bans(self):
+        return await self.run(self.sync.get_bans)
+
+    async def get_motd_entry(self, update=False):
+        return await self.run(self.sync.get_motd_entry, update)
+
+    async def get_motd_max(self):
+        return await self.run(self.sync.get_motd_max)
+
+    async def submit_motd(self, author, content):
+        return await self.run(self.sync.submit_motd, author, content)
+
+    async def update_motd(self, num, approve=True):
+        return await self.run(self.sync.update_motd, num, approve)
+
+    async def count_motd(self):
+        return await self.run(self.sync.count_motd)
+
+    async def get_sub(self, code):
+        return await self.run(self.sync.get_sub, code)
+
+    async def get_sub_by_name(self, name):
+        return await self.run(self.sync.get_sub_by_name, name)
+
+    async def get_subs(self):
+        return await self.run(self.sync.get_subs)
+
+    async def add_sub(self, name, code):
+        return await self.run(self.sync.add_sub, name, code)
+
+    async def delete_sub(self, code):
+        return await self.run(self.sync.delete_sub, code)
+
+    async def subscribe(self, code, uid):
+        return await self.run(self.sync.subscribe, code, uid)
+
+    async def unsubscribe(self, code, uid):
+        return await self.run(self.sync.unsubscribe, code, uid)
+
+    async def get_member_subs(self, uid):
+        return await self.run(self.sync.get_member_subs, uid)
+
+    async def record_notification(self, code, author, outcomes):
+        return await self.run(self.sync.record_notification, code, author,
+                              outcomes)
+
+    async def get_ac_endings(self):
+        return await self.run(self.sync.get_ac_endings)
+
+    async def get_dino(self, uid):
+        return await self.run(self.sync.get_dino, uid)
+
+    async def add_dino(self, uid, name, fact):
+        return await self.run(self.sync.add_dino, uid, name, fact)
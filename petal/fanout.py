@@ -0,0 +1,177 @@
+"""
+Sends one message to a lot of members at once. A few sends run at a time,
+paced per route and overall so discord's rate limits are not tripped, and
+progress is shown by editing a single status message
+"""
+
+import asyncio
+import discord
+import time
+from collections import OrderedDict
+from .grasslands import Peacock
+log = Peacock()
+
+SENT = "sent"
+MISSING = "missing"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+
+class Pacer(object):
+    """
+    Hands out evenly spaced send slots, at most rate per `per` seconds.
+    A 429 pushes every later slot back by the retry delay
+    """
+    def __init__(self, rate=5, per=1.0):
+        self.interval = per / rate
+        self.next = 0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self.next)
+        self.next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def penalize(self, delay):
+        self.next = max(self.next, time.monotonic() + delay)
+
+
+class Fanout(object):
+    def __init__(self, client, concurrency=4, rate=5, per=1.0,
+                 progress=3.0, retries=2, routeRate=5, routePer=5.0):
+        """
+        :param client: the Petal client
+        :param concurrency: sends in flight at once
+        :param rate: sends allowed per `per` seconds across every route
+        :param per: seconds
+        :param progress: seconds between edits of the status message
+        :param retries: extra attempts for a rate limited send
+        :param routeRate: sends allowed per `routePer` seconds to any one
+            channel
+        :param routePer: seconds
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.pacer = Pacer(rate, per)
+        self.routeRate = routeRate
+        self.routePer = routePer
+        self.routes = {}
+        self.progress = progress
+        self.retries = retries
+
+    def route(self, destination):
+        """
+        :param destination: member or channel, each is its own route
+        :return: the Pacer for it
+        """
+        pacer = self.routes.get(destination.id)
+        if pacer is None:
+            pacer = self.routes[destination.id] = Pacer(self.routeRate,
+                                                         self.routePer)
+        return pacer
+
+    @staticmethod
+    def retry_after(e):
+        """
+        :param e: HTTPException for a 429
+        :return: (seconds to wait or None if discord didn't say, whether the
+            limit is global)
+        """
+        headers = getattr(e.response, "headers", None) or {}
+        delay = getattr(e, "retry_after", None)
+        if delay is None and headers.get("Retry-After") is not None:
+            try:
+                delay = float(headers["Retry-After"])
+            except ValueError:
+                delay = None
+        glob = str(headers.get("X-RateLimit-Global", "")).lower() == "true"
+        return delay, glob
+
+    async def send_one(self, member, content):
+        route = self.route(member)
+        for attempt in range(self.retries + 1):
+            await route.wait()
+            await self.pacer.wait()
+            try:
+                sent = await self.client.send_message(None, member, content)
+            except discord.errors.Forbidden:
+                return BLOCKED
+            except discord.errors.HTTPException as e:
+                if getattr(e.response, "status", None) != 429:
+                    log.f("fanout", "Send to " + member.id + " failed: "
+                          + str(e))
+                    return FAILED
+                delay, glob = self.retry_after(e)
+                if delay is None:
+                    delay = 2 ** attempt
+                (self.pacer if glob else route).penalize(delay)
+            except discord.errors.ClientException:
+                return FAILED
+            else:
+                # Petal.send_message swallows Forbidden and returns None
+                return SENT if sent is not None else BLOCKED
+        return FAILED
+
+    @staticmethod
+    def summary(outcomes, total):
+        counts = OrderedDict((k, 0) for k in (SENT, BLOCKED, MISSING, FAILED))
+        for outcome in outcomes.values():
+            counts[outcome] += 1
+        done = ", ".join("{} {}".format(v, k) for k, v in counts.items() if v)
+        return "{}/{} done: {}".format(len(outcomes), total, done or "-")
+
+    async def send(self, server, uids, content, status_channel=None,
+                   title="Notifying"):
+        """
+        :param server: discord.Server the recipients are looked up in
+        :param uids: iterable of member ids, duplicates are sent once
+        :param content: str message to send
+        :param status_channel: channel for the progress message
+        :param title: first line of the progress message
+        :return: OrderedDict of uid -> sent/blocked/missing/failed
+        """
+        uids = list(OrderedDict.fromkeys(uids))
+        outcomes = OrderedDict()
+        pending = iter(uids)
+        status = None
+        if status_channel is not None:
+            status = await self.client.send_message(
+                None, status_channel, title + "... 0/" + str(len(uids)))
+
+        async def worker():
+            for uid in pending:
+                member = server.get_member(uid)
+                if member is None:
+                    outcomes[uid] = MISSING
+                    continue
+                outcomes[uid] = await self.send_one(member, content)
+
+        async def report():
+            last = None
+            while True:
+                await asyncio.sleep(self.progress)
+                text = title + "... " + self.summary(outcomes, len(uids))
+                if text != last:
+                    await self.update(status, text)
+                    last = text
+
+        reporter = None
+        if status is not None:
+            reporter = asyncio.ensure_future(report())
+        try:
+            await asyncio.gather(*[worker() for _ in
+                                   range(min(self.concurrency, len(uids)))])
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+        if status is not None:
+            await self.update(status, title + " finished. "
+                              + self.summary(outcomes, len(uids)))
+        return outcomes
+
+    async def update(self, status, text):
+        try:
+            await self.client.edit_message(status, text)
+        except discord.errors.HTTPException as e:
+            log.f("fanout", "Could not update status: " + str(e))
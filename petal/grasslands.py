@@ -2,64 +2,451 @@
 Grasslands is a semi-public module for colored logging
 """
 
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime as dt
-from random import randint
+from logging.handlers import RotatingFileHandler
+from random import randint, sample
+from urllib.parse import urlencode, urlsplit
 from colorama import init, Fore
-import requests
+import aiohttp
+
+# Numeric severity of each Peacock method, anything under the configured
+# level is dropped before it is formatted
+LEVELS = {"debug": 10, "f": 10,
+          "log": 20, "info": 20, "com": 20, "member": 20, "ready": 20,
+          "warn": 30,
+          "err": 40}
+
+# Console colour and tag of each method in text mode
+STYLES = {"log": (Fore.WHITE, "LOG"), "info": (Fore.CYAN, "INFO"),
+          "warn": (Fore.YELLOW, "WARN"), "err": (Fore.RED, "ERROR"),
+          "com": (Fore.BLUE, "COMMAND"), "member": (Fore.CYAN, "MEMBER"),
+          "debug": (Fore.MAGENTA, "DEBUG"), "ready": (Fore.GREEN, "READY"),
+          "f": (Fore.MAGENTA, "FUNC")}
 
 
 class Peacock(object):
+    """
+    Every Peacock shares one queue and one writer thread, so logging from
+    the event loop never waits on stdout or the log file
+    """
+    threshold = 0
+    pending = queue.Queue()
+    writer = None
+    lock = threading.Lock()
+    file = None
+    color = True
+    structured = False
+    batch = 256
+
     def __init__(self, painter=None):
-        init()
+        Peacock.start()
+
+    @classmethod
+    def configure(cls, level="debug", logfile=None, maxBytes=1 << 24,
+                  backupCount=5, color=True, batch=256, format="text"):
+        """
+        Sets up logging for the whole bot, every Peacock picks it up
+        :param level: lowest method name still logged (debug, info, warn, err)
+        :param logfile: also write plain lines to this file
+        :param maxBytes: size at which logfile is rotated
+        :param backupCount: number of rotated files kept
+        :param color: colorize stdout
+        :param batch: most lines written per flush
+        :param format: "text" or "json" for one JSON object per line
+        """
+        with cls.lock:
+            cls.threshold = LEVELS.get(level, 0)
+            cls.color = color
+            cls.structured = format == "json"
+            cls.batch = batch
+            if cls.file is not None:
+                cls.file.close()
+                cls.file = None
+            if logfile:
+                cls.file = RotatingFileHandler(logfile, maxBytes=maxBytes,
+                                               backupCount=backupCount,
+                                               encoding="utf-8")
+                cls.file.setFormatter(logging.Formatter("%(message)s"))
+        cls.start()
+
+    @classmethod
+    def start(cls):
+        with cls.lock:
+            if cls.writer is not None and cls.writer.is_alive():
+                return
+            init()
+            cls.writer = threading.Thread(target=cls.write_loop,
+                                          name="peacock", daemon=True)
+            cls.writer.start()
+            atexit.register(cls.drain)
+
+    @classmethod
+    def drain(cls, timeout=5):
+        """
+        Writes out whatever is still queued, used at exit
+        """
+        if cls.writer is None or not cls.writer.is_alive():
+            return
+        cls.pending.put(None)
+        cls.writer.join(timeout)
+
+    @classmethod
+    def write_loop(cls):
+        while True:
+            records = [cls.pending.get()]
+            while len(records) < cls.batch:
+                try:
+                    records.append(cls.pending.get_nowait())
+                except queue.Empty:
+                    break
+            done = None in records
+            cls.write([r for r in records if r is not None])
+            if done:
+                return
+
+    @staticmethod
+    def encode(record):
+        level, facility, wall, mono, message, fields = record
+        doc = {"ts": dt.utcfromtimestamp(wall).isoformat() + "Z",
+               "wall": wall, "mono": mono, "level": level,
+               "facility": facility, "msg": message}
+        if fields:
+            # Nested so a field can never overwrite ts, level, msg etc.
+            doc["extra"] = fields
+        return json.dumps(doc, default=str)
+
+    @classmethod
+    def write(cls, records):
+        lines = []
+        for record in records:
+            if cls.structured:
+                line = cls.encode(record)
+                if cls.file is not None:
+                    cls.file.emit(logging.makeLogRecord({"msg": line}))
+                lines.append(line)
+                continue
+            level, facility, wall, mono, message, fields = record
+            color, tag = STYLES[level]
+            if facility is not None:
+                tag += "/" + facility.upper()
+            line = "[{}] [{}] {}".format(
+                tag, dt.utcfromtimestamp(wall).strftime("%Y-%m-%d %H:%M:%S"),
+                message)
+            if cls.file is not None:
+                cls.file.emit(logging.makeLogRecord({"msg": line}))
+            line = line.encode("ascii", "ignore").decode("ascii")
+            lines.append(color + line + Fore.RESET if cls.color else line)
+        if lines:
+            try:
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+
+    def emit(self, level, message, facility=None, fields=None):
+        """
+        Queues one record. Keyword fields only show up in json mode, under
+        the line's "extra" key
+        """
+        if LEVELS[level] < Peacock.threshold:
+            return
+        Peacock.pending.put((level, facility, time.time(), time.monotonic(),
+                             str(message), fields))
 
     def timestamp(self):
         return "[{}]".format(str(dt.utcnow())[:-7])
 
-    def log(self, message):
-        print(Fore.WHITE + "[LOG] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii') + Fore.RESET, flush=True)
+    def log(self, message, **fields):
+        self.emit("log", message, fields=fields)
         return
 
-    def warn(self, message):
-        print(Fore.YELLOW + "[WARN] " + self.timestamp() +
-              " " + message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
+    def warn(self, message, **fields):
+        self.emit("warn", message, fields=fields)
         return
 
-    def err(self, message):
-        print(Fore.RED + "[ERROR] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
-
-    def info(self, message):
-        print(Fore.CYAN + "[INFO] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
-
-    def com(self, message):
-        print(Fore.BLUE + "[COMMAND] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
-
-    def member(self, message):
-        print(Fore.CYAN + "[MEMBER] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
+    def err(self, message, **fields):
+        self.emit("err", message, fields=fields)
+
+    def info(self, message, **fields):
+        self.emit("info", message, fields=fields)
+
+    def com(self, message, **fields):
+        self.emit("com", message, fields=fields)
+
+    def member(self, message, **fields):
+        self.emit("member", message, fields=fields)
+
+    def debug(self, message, **fields):
+        self.emit("debug", message, fields=fields)
+
+    def ready(self, message, **fields):
+        self.emit("ready", message, fields=fields)
+
+    def f(self, func="basic", message="", **fields):
+        self.emit("f", message, facility=str(func), fields=fields)
+
+
+class Magpie(object):
+    """
+    LRU cache of decoded responses keyed by url. Each entry expires after
+    the TTL of the source it came from, and the whole cache can be kept in
+    a file between restarts
+    """
+    TTL = {"default": 300,
+           "xkcd": 3600,           # the latest comic
+           "xkcd-comic": 604800,   # a numbered comic never changes
+           "wiki": 86400,
+           "imgur": 600}
+
+    def __init__(self, size=512, ttl=None, file=None):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.file = None
+        self.configure(size, ttl, file)
+
+    def configure(self, size=512, ttl=None, file=None):
+        """
+        :param size: most entries kept, least recently used go first
+        :param ttl: dict of source name -> seconds, merged over Magpie.TTL
+        :param file: json file to load the cache from and save it to
+        """
+        self.size = size
+        self.ttl = dict(self.TTL)
+        self.ttl.update(ttl or {})
+        if file and file != self.file:
+            self.file = file
+            self.load()
+            atexit.register(self.save)
+        self.trim()
+
+    @staticmethod
+    def key(url, params=None):
+        if not params:
+            return url
+        return url + "?" + urlencode(sorted(params.items()))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, source="default"):
+        ttl = self.ttl.get(source, self.ttl["default"])
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+        self.trim()
+
+    def trim(self):
+        with self.lock:
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.entries), "max": self.size}
+
+    def load(self):
+        try:
+            with open(self.file) as fp:
+                saved = json.load(fp)
+        except (OSError, ValueError) as e:
+            Peacock().f("cache", "Starting with an empty cache: " + str(e))
+            return
+        now = time.time()
+        with self.lock:
+            for key, (expires, value) in saved:
+                if expires > now:
+                    self.entries[key] = (expires, value)
+
+    def save(self):
+        if not self.file:
+            return
+        now = time.time()
+        with self.lock:
+            live = [(k, v) for k, v in self.entries.items() if v[0] > now]
+        tmp = self.file + ".tmp"
+        try:
+            with open(tmp, "w") as fp:
+                json.dump(live, fp)
+            os.replace(tmp, self.file)
+        except (OSError, TypeError, ValueError) as e:
+            Peacock().err("Could not save the response cache: " + str(e))
+
+
+class PelicanError(ConnectionError):
+    """
+    Raised by Pelican once a request has run out of retries
+    """
+    def __init__(self, url, reason):
+        super().__init__("{} failed: {}".format(url, reason))
+        self.url = url
+        self.reason = reason
+
+
+class Pelican(object):
+    """
+    Shared HTTP client. One keep-alive session for the whole bot, at most
+    perHost requests in flight to any one host, a timeout on every request
+    and retries with exponential backoff for connection errors and 5xx/429.
+    Only GET and HEAD are retried unless retries is passed explicitly, so a
+    slow POST is never sent twice
+    """
+    RETRY = frozenset((429, 500, 502, 503, 504))
+    IDEMPOTENT = frozenset(("GET", "HEAD"))
+
+    class Response(object):
+        def __init__(self, url, status, headers, body):
+            self.url = url
+            self.status = status
+            self.status_code = status
+            self.headers = headers
+            self.content = body
+
+        def __repr__(self):
+            return "<Response [{}] {}>".format(self.status, self.url)
+
+        @property
+        def ok(self):
+            return 200 <= self.status < 300
+
+        def text(self):
+            return self.content.decode("utf-8", "replace")
+
+        def json(self):
+            return json.loads(self.text())
+
+    def __init__(self, timeout=10, retries=2, backoff=0.5, perHost=4,
+                 limit=64, userAgent="Petalbot"):
+        """
+        :param timeout: seconds before a single attempt is abandoned
+        :param retries: extra attempts after the first one fails
+        :param backoff: first retry delay in seconds, doubled each retry
+        :param perHost: concurrent requests allowed per host
+        :param limit: total pooled connections
+        :param userAgent: default User-Agent header
+        """
+        self.configure(timeout, retries, backoff, perHost, limit, userAgent)
+        self.session = None
+        self.hosts = {}
+        self.cache = Magpie()
+        self.log = Peacock()
+
+    def configure(self, timeout=10, retries=2, backoff=0.5, perHost=4,
+                  limit=64, userAgent="Petalbot"):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.perHost = perHost
+        self.limit = limit
+        self.userAgent = userAgent
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                headers={"User-Agent": self.userAgent})
+        return self.session
+
+    def get_semaphore(self, url):
+        host = urlsplit(url).netloc
+        sem = self.hosts.get(host)
+        if sem is None:
+            sem = self.hosts[host] = asyncio.Semaphore(self.perHost)
+        return sem
+
+    async def fetch(self, method, url, **kwargs):
+        async with self.get_session().request(method, url, **kwargs) as r:
+            body = await r.read()
+            return self.Response(str(r.url), r.status, r.headers, body)
+
+    async def request(self, method, url, timeout=None, retries=None,
+                      **kwargs):
+        """
+        :param method: HTTP method
+        :param url: full url
+        :param timeout: override the default timeout
+        :param retries: override the default retry count, which is 0 for
+        methods other than GET and HEAD
+        :param kwargs: passed on to aiohttp (params, headers, data, json)
+        :return: Pelican.Response, for any status not worth retrying
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if retries is None:
+            retries = self.retries if method in self.IDEMPOTENT else 0
+        sem = self.get_semaphore(url)
+        reason = None
+        for attempt in range(retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with sem:
+                    response = await asyncio.wait_for(
+                        self.fetch(method, url, **kwargs), timeout)
+            except asyncio.TimeoutError:
+                reason = "timed out after {}s".format(timeout)
+            except aiohttp.ClientError as e:
+                reason = type(e).__name__ + " " + str(e)
+            else:
+                if response.status not in self.RETRY or attempt == retries:
+                    return response
+                reason = "HTTP {}".format(response.status)
+            self.log.f("http", "{} {} attempt {}: {}".format(
+                method, url, attempt + 1, reason))
+        raise PelicanError(url, reason)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def get_json(self, url, cache=None, **kwargs):
+        """
+        :param cache: source name to cache the result under (see Magpie.TTL),
+        None to always fetch
+        :return: the decoded body, or None for a non 2xx response
+        """
+        if cache is not None:
+            key = Magpie.key(url, kwargs.get("params"))
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+        response = await self.get(url, **kwargs)
+        if not response.ok:
+            return None
+        body = response.json()
+        if cache is not None:
+            self.cache.put(key, body, cache)
+        return body
 
-    def debug(self, message):
-        print(Fore.MAGENTA + "[DEBUG] " + self.timestamp() + " " +
-              message.encode('ascii', 'ignore').decode('ascii')
-              + Fore.RESET, flush=True)
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+        self.cache.save()
 
-    def ready(self, message):
-        print(Fore.GREEN + "[READY] " + self.timestamp() + " " +
-              message.encode("ascii", "ignore").decode('ascii')
-              + Fore.RESET, flush=True)
 
-    def f(self, func="basic", message=""):
-        print(Fore.MAGENTA + "[FUNC/{}] ".format(func.upper())
-              + self.timestamp() + " " +
-              message.encode("ascii", "ignore").decode('ascii') + Fore.RESET, flush=True)
+pelican = Pelican()
 
 
 class Octopus(object):
@@ -98,30 +485,21 @@ class Octopus(object):
                          " Logger object)")
             return None
         self.key = API_KEY
-        response = requests.get("https://osu.ppy.sh/api/get_beatmaps?k={}" +
-                                "&limit={}".format(self.key, 1))
-        if "error" in response:
-            self.log.err("OSU Error: " + response["error"])
-            return None
-        else:
-            self.log.ready("OSU support enabled")
-
-    def get_user(self, userid, mode=0):
-        response = requests.get("https://osu.ppy.sh/api/get_user?k=" +
-                                "{}&m={}&u={}".format(self.key,
-                                                      mode,
-                                                      userid.strip()))
-        if response.json() == []:
+        self.log.ready("OSU support enabled")
+
+    async def get_user(self, userid, mode=0):
+        response = await pelican.get_json("https://osu.ppy.sh/api/get_user",
+                                          params={"k": self.key, "m": mode,
+                                                  "u": userid.strip()})
+        if not response or "error" in response:
             return None
-        user = self.Tentacle_user(response.json()[0])
+        user = self.Tentacle_user(response[0])
         return user
 
-    def get_beatmap(self, beatid, sets="", mode=0):
-        response = requests.get("https://osu.ppy.sh/api/get_beatmaps?k=" +
-                                "{}&s={}&b={}&m={}".format(self.key,
-                                                           sets,
-                                                           beatid,
-                                                           mode))
+    async def get_beatmap(self, beatid, sets="", mode=0):
+        response = await pelican.get_json(
+            "https://osu.ppy.sh/api/get_beatmaps",
+            params={"k": self.key, "s": sets, "b": beatid, "m": mode})
         return response
 
 
@@ -139,10 +517,10 @@ class Giraffe(object):
             self.log.ready("imgur support enabled")
         self.key = API_KEY
 
-    def get_image(self, imageID):
+    async def get_image(self, imageID):
         headers = {'Authorization': 'Client-Id {}'.format(self.key)}
-        req = requests.get('https://api.imgur.com/3/image/{}'.format(imageID),
-                           headers=headers)
+        req = await pelican.get('https://api.imgur.com/3/image/{}'
+                                .format(imageID), headers=headers)
         response = req.json()
 
         if not response['success']:
@@ -150,12 +528,11 @@ class Giraffe(object):
 
         return self.Imgur_Image(response["data"])
 
-    def get_random(self, albumID):
+    async def get_random(self, albumID):
         headers = {'Authorization': 'Client-Id {}'.format(self.key)}
-        req = requests.get('https://api.imgur.com/3/album/{}'.format(albumID),
-                           headers=headers)
+        req = await pelican.get('https://api.imgur.com/3/album/{}'
+                                .format(albumID), headers=headers)
         response = req.json()
-        print(response)
         if not response['success']:
             return None
 
@@ -163,14 +540,24 @@ class Giraffe(object):
                                                          len(response["data"])
                                                          - 1)])
 
-    def get_subreddit(self, subID):
-
+    async def get_gallery(self, subID):
+        """
+        Lists a subreddit's imgur gallery. The listing is cached, so picking
+        images from it again does not go back to imgur
+        :return: list of image dicts, None if imgur refused
+        """
         headers = {'Authorization': 'Client-Id {}'.format(self.key)}
-        req = requests.get('https://api.imgur.com/3/gallery/r/{}'
-                           .format(subID), headers=headers)
-        response = req.json()
+        response = await pelican.get_json('https://api.imgur.com/3/gallery/r/{}'
+                                          .format(subID), cache="imgur",
+                                          headers=headers)
+        if response is None or not response['success']:
+            return None
+        return response["data"]
 
-        if not response['success']:
+    async def get_subreddit(self, subID):
+        response = {"data": await self.get_gallery(subID)}
+
+        if response["data"] is None:
             return None
         if len(response["data"]) == 0:
             return None
@@ -188,17 +575,100 @@ class Giraffe(object):
             self.nsfw = data["nsfw"]
             self.link = data["link"]
 
+
+class Squirrel(object):
+    """
+    Keeps a few images per subreddit ready so the animal commands answer
+    without waiting on imgur. A pool is topped back up in the background
+    once it drops under the low water mark
+    """
+    def __init__(self, giraffe, subreddits, size=10, low=3,
+                 permitNSFW=lambda: False, log=Peacock()):
+        """
+        :param giraffe: Giraffe used to list the galleries
+        :param subreddits: subreddits to keep pools for
+        :param size: images kept per pool
+        :param low: refill once a pool has fewer than this many
+        :param permitNSFW: callable, whether NSFW images may be pooled
+        """
+        self.giraffe = giraffe
+        self.size = size
+        self.low = low
+        self.permitNSFW = permitNSFW
+        self.log = log
+        self.pools = {sr: deque() for sr in subreddits}
+        self.refilling = set()
+
+    def start(self):
+        for sr in self.pools:
+            self.schedule(sr)
+
+    def schedule(self, sr):
+        if sr in self.refilling:
+            return
+        self.refilling.add(sr)
+        asyncio.ensure_future(self.refill(sr))
+
+    def usable(self, data):
+        return (data.get("link") and not data.get("is_album")
+                and (not data.get("nsfw") or self.permitNSFW()))
+
+    async def refill(self, sr):
+        pool = self.pools[sr]
+        try:
+            gallery = await self.giraffe.get_gallery(sr)
+            if not gallery:
+                return
+            pooled = {image.link for image in pool}
+            fresh = [d for d in gallery
+                     if self.usable(d) and d["link"] not in pooled]
+            want = min(self.size - len(pool), len(fresh))
+            for data in sample(fresh, want):
+                pool.append(Giraffe.Imgur_Image(data))
+            self.log.f("prefetch", "{} now has {} images"
+                       .format(sr, len(pool)))
+        except Exception as e:
+            self.log.err("Could not prefetch images for " + sr + ": "
+                         + type(e).__name__ + " " + str(e))
+        finally:
+            self.refilling.discard(sr)
+
+    def take(self, sr):
+        """
+        :return: a pooled Imgur_Image, or None if sr has no pool or it is
+        empty right now
+        """
+        pool = self.pools.get(sr)
+        if pool is None:
+            return None
+        image = pool.popleft() if pool else None
+        if len(pool) < self.low:
+            self.schedule(sr)
+        return image
+
+
 class Pidgeon:
+    api_url = "https://en.wikipedia.org/w/api.php"
+
     def __init__(self, query, version="0.3.2"):
         self.query = query
-        api_url = "https://en.wikipedia.org/w/api.php?action=query&titles={q}&format=json&prop=extracts&exintro&explaintext"
-        url = api_url.format(q=query)
-        headers = {'User-Agent': 'Petalbot/' + version + ' (http://leaf.drunkencode.net/; nullexistence180@gmail.com) Python 3.5.2'}
-        # Peacock().f("wiki", str(headers))
-        req = requests.get(url, headers=headers)
-        self.response = req.json()
-
-    def get_summary(self):
+        self.headers = {'User-Agent': 'Petalbot/' + version + ' (http://leaf.drunkencode.net/; nullexistence180@gmail.com) Python 3.5.2'}
+        self.response = None
+
+    async def fetch(self):
+        params = {"action": "query", "titles": self.query, "format": "json",
+                  "prop": "extracts", "exintro": "", "explaintext": ""}
+        self.response = await pelican.get_json(self.api_url, params=params,
+                                               cache="wiki",
+                                               headers=self.headers)
+        return self.response
+
+    async def get_summary(self):
+        if self.response is None:
+            try:
+                await self.fetch()
+            except PelicanError as e:
+                return (0, "Wikipedia could not be reached: " + e.reason)
         if self.response is None:
             return (0, "No data returned for: " + self.query)
         try:
@@ -1,12 +1,19 @@
 import json
-import requests
 import datetime
+import os
+import sqlite3
+import tempfile
 from collections import OrderedDict
-from .grasslands import Peacock
-__all__ = ["WLRequest", "WLAdd", "WLQuery", "WLSuspend", "WLDump", "EXPORT_WHITELIST"]
-dbName = "/minecraft/playerdb.json" # file in which userdata is stored
+from .grasslands import Peacock, PelicanError, pelican
+from .playerdb import PlayerDB
+__all__ = ["WLRequest", "WLAdd", "WLQuery", "WLSuspend", "WLDump", "WLPending", "WLSuspended", "EXPORT_WHITELIST"]
+dbName = "/minecraft/playerdb.json" # old json database, imported into dbFile once
+dbFile = "/minecraft/playerdb.db" # sqlite database in which userdata is stored
 WhitelistFile = "/minecraft/whitelist.json" # The whitelist file itself
 log = Peacock()
+playerDB = None
+wlIndex = OrderedDict() # uuid -> whitelist.json entry, in file order
+wlStamp = None # (mtime, size) of WhitelistFile when wlIndex was read
 """
 ERROR CODES:
  0: Cmnd success: user added or approved, or request sent
@@ -24,32 +31,91 @@ ERROR CODES:
     # (Do not use this)
 PLAYERDEFAULT = OrderedDict([('name', 'PLAYERNAME'), ('uuid', '00000000-0000-0000-0000-000000000000'), ('altname', []), ('discord', '000000000000000000'), ('approved', []), ('submitted', '1970-01-01_00:00'), ('suspended', False)])
 
+def getDB(): # Open the player database on first use, None if it can't be
+    global playerDB
+    if playerDB is None:
+        try:
+            playerDB = PlayerDB(dbFile, legacy=dbName)
+        except (OSError, sqlite3.Error) as e:
+            log.err("Could not open player database: " + str(e))
+            return None
+        except ValueError as e: # The old json database couldn't be imported
+            log.err("Could not import player database: " + str(e))
+            return None
+    return playerDB
+
 def WLDump():
-    try:
-        dbRead = json.load(open(dbName), object_pairs_hook=OrderedDict)
-    except OSError: # File does not exist: Pointless to continue
-        log.err("OSError on DB read: " + str(e))
+    db = getDB()
+    if db is None: # Database unavailable: Pointless to continue
         return -7
-    return dbRead
+    return db.all()
 
-def WLSave(dbRead):
-    try:
-        json.dump(dbRead, open(dbName, 'w'), indent=2) # Save all the things
-        ret = 0
-    except OSError: # Cannot write file: Well this was all rather pointless
-        log.err("OSError on DB save: " + str(e))
-        ret = -7
-    return ret
+def WLPending(): # Players nobody has approved yet
+    db = getDB()
+    if db is None:
+        return -7
+    return db.pending()
 
-def EXPORT_WHITELIST(refreshall=False, refreshnet=False):
+def WLSuspended():
+    db = getDB()
+    if db is None:
+        return -7
+    return db.suspended()
+
+def loadWhitelist(force=False): # Reread the whitelist only if something else changed it
+    global wlIndex, wlStamp
+    st = os.stat(WhitelistFile)
+    stamp = (st.st_mtime_ns, st.st_size)
+    if force or stamp != wlStamp:
+        with open(WhitelistFile) as fp:
+            wlIndex = OrderedDict((item["uuid"], item) for item in json.load(fp))
+        wlStamp = stamp
+    return wlIndex
+
+def saveWhitelist(): # Swap in a complete file, so the server never reads half of one
+    global wlStamp
+    folder = os.path.dirname(os.path.abspath(WhitelistFile))
+    fd, tmp = tempfile.mkstemp(prefix=".whitelist.", suffix=".json", dir=folder)
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(list(wlIndex.values()), fp, indent=2)
+            fp.flush()
+            os.fsync(fp.fileno())
+        if os.path.exists(WhitelistFile):
+            os.chmod(tmp, os.stat(WhitelistFile).st_mode & 0o777)
+        os.replace(tmp, WhitelistFile)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    st = os.stat(WhitelistFile)
+    wlStamp = (st.st_mtime_ns, st.st_size)
+
+def applyWhitelist(applicant): # Bring one applicant's whitelist entry in line with the database
+    app = wlIndex.get(applicant["uuid"]) # Is the applicant already whitelisted?
+    if app is None and len(applicant["approved"]) > 0 and applicant["suspended"] == False: # Applicant is not whitelisted AND is approved, add them
+        wlIndex[applicant["uuid"]] = {'uuid': applicant["uuid"], 'name': applicant["name"]}
+        return True
+    elif app is not None and applicant["suspended"] == True: #BadPersonAlert, remove them
+        del wlIndex[applicant["uuid"]]
+        return True
+    return False
+
+async def EXPORT_WHITELIST(refreshall=False, refreshnet=False, changed=None):
     # Export the local database into the whitelist file itself
     # If Mojang ever changes the format of the server whitelist file, this is the function that will need to be updated
-    try: # Stage 0: Load the full database as ordered dicts, and the whitelist as dicts
-        dbRead = json.load(open(dbName), object_pairs_hook=OrderedDict)
-        wlFile = json.load(open(WhitelistFile))
-        #wlFile = [] # Uncommenting this will force the whitelist to contain ONLY people in the DB file
-                     # (This will also force the whitelist file to be in the same order as the DB file)
-    except OSError: # File does not exist: Pointless to continue
+    # changed: uuids of the players to update, None checks everyone
+    global wlStamp
+    db = getDB()
+    if db is None:
+        return 0
+    try: # Stage 0: Load the whitelist, reusing the index unless the file changed
+        loadWhitelist(force=refreshall)
+        if refreshall == True or changed is None:
+            dbRead = db.all()
+        else:
+            dbRead = [app for app in (db.get(uuid) for uuid in changed) if app is not None]
+    except (OSError, ValueError, sqlite3.Error): # File does not exist: Pointless to continue
         return 0
 
     if refreshall == True: # Rebuild Index
@@ -59,26 +125,29 @@ def EXPORT_WHITELIST(refreshall=False, refreshnet=False):
             appNew.update(applicant)
 
             if refreshnet == True: # Stage 3, optional: Rebuild username history
-                namehist = requests.get("https://api.mojang.com/user/profiles/{}/names".format(applicant["uuid"].replace("-","")))
+                namehist = await nameHistory(applicant["uuid"])
 
-                if namehist.status_code == 200:
+                if namehist is not None and namehist.status_code == 200:
                     appNew.update(altname=[]) # Spy on their dark and shadowy past
                     for name in namehist.json():
                         appNew["altname"].append(name["name"])
                         appNew["name"] = name["name"] # Ensure the name is up to date
 
             dbNew.append(appNew)
-        json.dump(dbNew, open(dbName, 'w'), indent=2)
+        db.put(dbNew)
         dbRead = dbNew
 
-    for applicant in dbRead: # Check everyone who has applied
-        app = next((item for item in wlFile if item["uuid"] == applicant["uuid"]), False) # Is the applicant already whitelisted?
-        if app == False and len(applicant["approved"]) > 0 and applicant["suspended"] == False: # Applicant is not whitelisted AND is approved, add them
-            wlFile.append({'uuid': applicant["uuid"], 'name': applicant["name"]})
-        elif app != False and applicant["suspended"] == True: #BadPersonAlert, remove them
-            wlFile.remove(app)
+    dirty = False
+    for applicant in dbRead: # Check everyone who has applied, or just who changed
+        dirty = applyWhitelist(applicant) or dirty
 
-    json.dump(wlFile, open(WhitelistFile, 'w'), indent=2)
+    if dirty:
+        try:
+            saveWhitelist()
+        except OSError as e:
+            log.err("Could not write whitelist: " + str(e))
+            wlStamp = None # The index no longer matches the file, reread it next time
+            return 0
     return 1
 
 def breakUID(str0): # Break apart Mojang UUID with dashes
@@ -90,37 +159,46 @@ def breakUID(str0): # Break apart Mojang UUID with dashes
     str99 = str1 + "-" + str2 + "-" + str3 + "-" + str4 + "-" + str5
     return str99
 
-def writeLocalDB(player): # update db from ephemeral player; write db to file
+# Mojang's record of every name a player has used, None if it can't be reached
+async def nameHistory(uuid):
+    try:
+        return await pelican.get("https://api.mojang.com/user/profiles/{}/names".format(uuid.replace("-","")))
+    except PelicanError as e:
+        log.err("Name history lookup failed: " + str(e))
+        return None
 
-    dbRead = WLDump()
-    if dbRead == -7: # File does not exist: Create the file
-        dbRead = [{'uuid': uidF, 'name': [uname]}]
+async def writeLocalDB(player): # add ephemeral player to the db unless they are already in it
 
-    pIndex = next((item for item in dbRead if item["uuid"] == player["uuid"]), False) # Is the player found in the list?
+    db = getDB()
+    if db is None: # Database unavailable: Pointless to continue
+        return -7
 
-    if pIndex == False: # Player is not in the database -- Create entry
+    try:
+        pIndex = db.get(player["uuid"]) # Is the player found in the database?
 
-        # Fetch username history
-        namehist = requests.get("https://api.mojang.com/user/profiles/{}/names".format(player["uuid"].replace("-","")))
-        if namehist.status_code == 200:
-            player["altname"] = []
-            for name in namehist.json():
-                player["altname"].append(name["name"])
+        if pIndex is None: # Player is not in the database -- Create entry
 
-        dbRead.append(player) # Set up a new profile with all the right fields
-        ret = 0
-    else:
-        pIndex = dbRead.index(pIndex) # DBase index of player (integer 0+)
-        if len(dbRead[pIndex]["approved"]) > 0: # If the user is approved, say something different
-            ret = -1
+            # Fetch username history
+            namehist = await nameHistory(player["uuid"])
+            if namehist is not None and namehist.status_code == 200:
+                player["altname"] = []
+                for name in namehist.json():
+                    player["altname"].append(name["name"])
+
+            if db.add(player): # Set up a new profile with all the right fields
+                return 0
+            pIndex = db.get(player["uuid"]) # Someone else added them while we were asking Mojang
+
+        if len(pIndex["approved"]) > 0: # If the user is approved, say something different
+            return -1
         else:
-            ret = -2
-    if WLSave(dbRead) != 0:
-        ret = -7
-    return ret
+            return -2
+    except sqlite3.Error as e:
+        log.err("Player DB write failed: " + str(e))
+        return -7
 
 # User wants to be whitelisted? Add to the database for approval
-def addToLocalDB(userdat, submitter):
+async def addToLocalDB(userdat, submitter):
     uid = userdat["id"]
     uidF = breakUID(uid)
     uname = userdat["name"]
@@ -133,12 +211,16 @@ def addToLocalDB(userdat, submitter):
     # Apply the values to a blank slate
     pNew = PLAYERDEFAULT.copy() # Get the slate
     pNew.update(eph) # Imprint anything new from the player
-    return writeLocalDB(pNew), uidF
+    return await writeLocalDB(pNew), uidF
 
 # User gave us a username? Text is worthless. Hey Mojang, UUID is this name?
-def idFromName(uname_raw):
+async def idFromName(uname_raw):
     uname_low = uname_raw.lower()
-    response = requests.get("https://api.mojang.com/users/profiles/minecraft/{}".format(uname_low))
+    try:
+        response = await pelican.get("https://api.mojang.com/users/profiles/minecraft/{}".format(uname_low))
+    except PelicanError as e:
+        log.err("Mojang lookup failed: " + str(e))
+        return {'code':0}
     log.f("WLME_RESP", str(response))
     if response.status_code == 200:
         return {'code':response.status_code, 'udat':response.json() }
@@ -150,10 +232,10 @@ def idFromName(uname_raw):
 ###---
 
 # !wlme <username>
-def WLRequest(nameGiven, discord_id):
-    udict = idFromName(nameGiven) # Get the id from the name, or an error
+async def WLRequest(nameGiven, discord_id):
+    udict = await idFromName(nameGiven) # Get the id from the name, or an error
     if udict["code"] == 200: # If this is 200, the second part will contain json data; Try to add it
-        verdict, uid = addToLocalDB(udict["udat"], discord_id)
+        verdict, uid = await addToLocalDB(udict["udat"], discord_id)
         return verdict, uid
     # Map response codes to function errors
     elif udict["code"] == 204:
@@ -167,76 +249,73 @@ def WLRequest(nameGiven, discord_id):
 
 
 # !wl <ticket>
-def WLAdd(idTarget, idSponsor):
-    dbRead = WLDump()
-    if dbRead == -7:
-        return -7
-    # idTarget can be a Discord ID, Mojang ID, or Minecraft username; Search for all of these
-    pIndex = next((item for item in dbRead if item["uuid"] == idTarget), False) # Is the target player found in the database?
+async def WLAdd(idTarget, idSponsor):
+    db = getDB()
+    if db is None:
+        return -7, False, -1, "<Error>", 0
 
     targetid = -1
     targetname = "<Error>"
     doSend = False
+    pIndex = None
 
-    if pIndex == False: # Maybe try the Minecraft name?
-        pIndex = next((item for item in dbRead if item["name"].lower() == idTarget.lower()), False)
-
-    if pIndex == False: # ...Discord ID?
-        pIndex = next((item for item in dbRead if item["discord"] == idTarget), False)
+    try:
+        # idTarget can be a Discord ID, Mojang ID, or Minecraft username; Search for all of these
+        pIndex = db.find(idTarget) # Is the target player found in the database?
 
-    if pIndex == False: # Fine. Player is not in the database -- Refuse to continue
-        log.f("wlme", "IndexError player not in DB")
-        ret = -8
-    else:
-        targetid = pIndex["discord"]
-        targetname = pIndex["name"]
-        #pIndex = dbRead.index(pIndex) # DBase index of player (integer 0+) # why?
-        if idSponsor not in pIndex["approved"]: # User approves new whitelisting
-            pIndex["approved"].append(idSponsor)
-            ret = 0
-            if len(pIndex["approved"]) == 1: # User is the first approver
-                doSend = True # Send the person a PM
-        else: # User has already approved whitelisting
-            ret = -2
-
-    if WLSave(dbRead) != 0:
+        if pIndex is None: # Fine. Player is not in the database -- Refuse to continue
+            log.f("wlme", "IndexError player not in DB")
+            ret = -8
+        else:
+            targetid = pIndex["discord"]
+            targetname = pIndex["name"]
+            approvals = db.approve(pIndex["uuid"], idSponsor) # User approves new whitelisting
+            if approvals is not None:
+                ret = 0
+                if approvals == 1: # User is the first approver
+                    doSend = True # Send the person a PM
+            else: # User has already approved whitelisting
+                ret = -2
+    except sqlite3.Error as e:
+        log.err("Player DB write failed: " + str(e))
         ret = -7
-    return ret, doSend, targetid, targetname, EXPORT_WHITELIST()
+    changed = [] if pIndex is None else [pIndex["uuid"]]
+    return ret, doSend, targetid, targetname, await EXPORT_WHITELIST(changed=changed)
 
 
 
 # !wlquery <ticket>
 def WLQuery(instr):
-    dbRead = WLDump()
-    if dbRead == -7:
+    db = getDB()
+    if db is None:
         return -7
     res = []
     in2 = instr.split(" ")
     for in3 in in2:
-        for entry in dbRead:
-            for attr in entry:
-                if entry[attr] == in3 and entry not in res:
-                    res.append(entry)
-            if in3.lower() in (val.lower() for val in entry["altname"]) and entry not in res:
+        for entry in db.search(in3): # uuid, discord id, or any name they have used
+            if entry not in res:
                 res.append(entry)
     return res
 
 
 
 # !wlsuspend bad_person
-def WLSuspend(baddies, sus=True):
-    dbRead = WLDump()
-    if dbRead == -7: # File does not exist: Pointless to continue
-        return -7
+async def WLSuspend(baddies, sus=True):
+    db = getDB()
+    if db is None: # Database unavailable: Pointless to continue
+        return [{"name" : target["name"], "change" : -7} for target in baddies], 0
     actions = []
     for target in baddies:
         act = -9
         try:
-            found = dbRead[dbRead.index(target)]
-        except OSError:
-            act = -8
+            was = db.set_suspended(target["uuid"], sus) # Each change is saved on its own
+        except sqlite3.Error as e:
+            log.err("Player DB write failed: " + str(e))
+            act = -7
         else:
-            if found["suspended"] == sus:
+            if was is None:
+                act = -8
+            elif was == sus:
                 if sus == True:
                     act = -2 # -2: Already suspended
                 else:
@@ -246,13 +325,6 @@ def WLSuspend(baddies, sus=True):
                     act = 0 # 0: Suspended
                 else:
                     act = -1 # -1: Forgiven
-            found["suspended"] = sus
         actions.append({"name" : target["name"], "change" : act})
-    try:
-        json.dump(dbRead, open(dbName, 'w'), indent=2) # Save all the things
-        wlwin = EXPORT_WHITELIST()
-    except OSError: # oh no
-        for revise in actions:
-            revise["change"] = -7 # Could not update the database, so NOTHING that we just did actually saved
-        wlwin = 0
+    wlwin = await EXPORT_WHITELIST(changed=[target["uuid"] for target in baddies])
     return actions, wlwin
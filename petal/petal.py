@@ -5,15 +5,15 @@ written by isometricramen
 """
 
 import discord
-import re
 import asyncio
 import calendar
-import time
 from datetime import datetime
-from .grasslands import Peacock
+from .grasslands import Peacock, pelican
 from .config import Config
 from .commands import Commands
-from .dbhandler import DBHandler
+from .dbhandler import DBHandler, AsyncDBHandler
+from .scheduler import Scheduler
+from .reminders import Reminders
 # from random import randint
 log = Peacock()
 
@@ -30,9 +30,18 @@ class Petal(discord.Client):
         else:
             log.info("Client object initialized")
 
-        self.config = Config()
-        self.db = DBHandler(self.config)
+        self.config = Config(autosave=not devmode)
+        Peacock.configure(**(self.config.doc.get("logging") or {}))
+        pelican.configure(**(self.config.doc.get("http") or {}))
+        pelican.cache.configure(**(self.config.doc.get("httpCache") or {}))
+        self.db = AsyncDBHandler(DBHandler(self.config))
+        self.scheduler = Scheduler()
+        self.scheduler.register("unban", self.scheduled_unban)
+        self.reminders = Reminders(self, window=(self.config.doc.get("dbconf")
+                                                 or {}).get("reminderWindow",
+                                                            3600))
         self.commands = Commands(self)
+        self.role_grants = {}
 
 
         self.dev_mode = devmode
@@ -53,6 +62,11 @@ class Petal(discord.Client):
             exit(401)
         return
 
+    async def close(self):
+        await self.db.flush_activity()
+        await pelican.close()
+        await super().close()
+
     @staticmethod
     def is_pm(message):
         if message.channel.is_private:
@@ -70,14 +84,31 @@ class Petal(discord.Client):
             exit(404)
         return self.config.get("mainServer")
 
-    async def save_loop(self):
-        if self.dev_mode:
-            return
-        interval = self.config.get("autosaveInterval")
+    def bind_role_grants(self):
+        """
+        Resolves the compiled roleGrant rules against the main server so
+        on_message never has to look roles up
+        """
+        server = self.get_server(self.config.get("mainServer"))
+        if server is None:
+            self.role_grants = {}
+            return self.role_grants
+        grants = {}
+        for chan, rules in self.config.roleGrants.items():
+            bound = tuple(rule.bind(server) for rule in rules)
+            for rule in bound:
+                if rule.role is None:
+                    log.warn("roleGrant role " + rule.role_key
+                             + " not found on the main server")
+            grants[chan] = bound
+        self.role_grants = grants
+        return grants
+
+    async def activity_loop(self):
+        interval = self.config.get("dbconf").get("flushInterval", 30)
         while True:
-            self.config.save()
             await asyncio.sleep(interval)
-
+            await self.db.flush_activity()
 
     async def ask_patch_loop(self):
         if self.dev_mode:
@@ -91,37 +122,42 @@ class Petal(discord.Client):
 
             await asyncio.sleep(interval)
 
-    async def ban_loop(self):
-        # if self.dev_mode:
-        #     return
-        mainserver = self.get_server(self.config.get("mainServer"))
-        interval = self.config.get("unbanInterval")
-        log.f("BANS", "Checking for temp unbans (Interval: " + str(interval) + ")")
-        await asyncio.sleep(interval)
-        while True:
-            epoch = int(time.time())
-            log.f("BANS", "Now Timestamp: " + str(epoch))
-
-            banlist = await self.get_bans(mainserver)
-
-            for m in banlist:
-                #log.f("UNBANS", m.name + "({})".format(m.id))
-                ban_expiry = self.db.get_attribute(m, "banExpires", verbose=False)
-                if ban_expiry is None:
-                    continue
-                elif int(ban_expiry) <= int(epoch):
-                    log.f(str(ban_expiry) + " compared to " + str(epoch))
-                    print(flush=True)
-                    await self.unban(mainserver, m)
-                    log.f("BANS", "Unbanned " + m.name + " ({}) ".format(m.id))
-                else:
-                    log.f("BANS", m.name + " ({}) has {} seconds left".format(m.id, str((int(ban_expiry) - int(epoch)))))
-                await asyncio.sleep(0.5)
-
-            await asyncio.sleep(interval)
-
-
+    async def load_bans(self):
+        """
+        Schedules every pending tempban stored in the database
+        """
+        bans = await self.db.get_bans()
+        for ban in bans:
+            self.schedule_unban(ban["uid"], ban["server"], ban["expires"])
+        log.f("BANS", "Scheduled " + str(len(bans)) + " unbans")
 
+    def schedule_unban(self, uid, server, expires):
+        """
+        :param uid: str banned user id
+        :param server: str server id
+        :param expires: unix timestamp to unban at
+        """
+        return self.scheduler.schedule(expires, "unban",
+                                       {"uid": uid, "server": server},
+                                       key=("unban", uid, server))
+
+    async def scheduled_unban(self, ban):
+        server = self.get_server(ban["server"])
+        if server is None:
+            log.warn("Can't unban " + ban["uid"] + ", not connected to "
+                     + "server " + ban["server"])
+            return
+        try:
+            await self.unban(server, discord.Object(id=ban["uid"]))
+        except discord.errors.NotFound:
+            log.f("BANS", ban["uid"] + " was already unbanned")
+        except discord.errors.Forbidden:
+            log.err("No permission to unban " + ban["uid"] + " from "
+                    + server.name)
+            return
+        else:
+            log.f("BANS", "Unbanned " + ban["uid"] + " from " + server.name)
+        await self.db.delete_ban(ban["uid"], ban["server"])
 
     async def on_ready(self):
         """
@@ -133,12 +169,27 @@ class Petal(discord.Client):
                  .format(self.user))
         log.info("Prefix: " + self.config.prefix)
         log.info("SelfBot: " + ['true', 'false'][self.config.useToken])
+        self.bind_role_grants()
+        if hasattr(self.commands, "squirrel"):
+            self.commands.squirrel.start()
+            log.ready("Image prefetch running...")
 
-        self.loop.create_task(self.save_loop())
-        log.ready("Autosave coroutine running...")
-        self.loop.create_task(self.ban_loop())
-        log.ready("Auto-unban coroutine running...")
-        if self.config.get("dbconf") is not None:
+        self.loop.create_task(self.scheduler.run())
+        if self.config.get("dbconf") is not None and self.db.useDB:
+            try:
+                await self.load_bans()
+                log.ready("Auto-unban scheduler running...")
+            except Exception as e:
+                log.err("Could not load tempbans: " + type(e).__name__
+                        + " " + str(e))
+            try:
+                await self.reminders.start()
+                log.ready("Reminders running...")
+            except Exception as e:
+                log.err("Could not load reminders: " + type(e).__name__
+                        + " " + str(e))
+            self.loop.create_task(self.activity_loop())
+            log.ready("Member activity buffer running...")
             self.loop.create_task(self.ask_patch_loop())
             log.ready("MOTD system running...")
             pass
@@ -155,10 +206,8 @@ class Petal(discord.Client):
         if self.dev_mode:
             message = "[DEV]  " + str(message) + "  [DEV]"
         if author is not None:
-            if self.db.get_member(author) is not None:
-                if self.db.get_attribute(author, "ac", verbose=False) is not None:
-                    if self.db.get_attribute(author, "ac"):
-                        message += " , " + self.commands.get_ac()
+            if await self.db.get_attribute(author, "ac", verbose=False):
+                message += " , " + await self.commands.get_ac()
         try:
             return await super().send_message(channel, message)
         except discord.errors.InvalidArgument:
@@ -190,17 +239,18 @@ class Petal(discord.Client):
         if Petal.logLock:
             return
 
-        self.db.update_member(member, {"aliases": [member.name],
-                                       "servers": [member.server.id]})
+        await self.db.update_member(member, {"aliases": [member.name],
+                                             "servers": [member.server.id]})
 
-        if self.db.add_member(member):
+        if await self.db.add_member(member):
             user_embed = discord.Embed(title="User Joined",
                                       description="A new user joined: "
                                       + member.server.name, colour=0x00FF00)
         else:
-            if len(self.db.get_attribute(member, "aliases")) != 0:
+            aliases = await self.db.get_attribute(member, "aliases")
+            if len(aliases) != 0:
                 user_embed = discord.Embed(title="User ReJoined",
-                                          description=self.db.get_attribute(member, "aliases")[-1]
+                                          description=aliases[-1]
                                           + " rejoined " + member.server.name
                                           + " as " + member.name,
                                           colour=0x00FF00)
@@ -430,27 +480,24 @@ class Petal(discord.Client):
         await self.wait_until_ready()
         content = message.content.strip()
         if not message.channel.is_private:
-            self.db.update_member(message.author,
-                                  {"aliases": message.author.name,
-                                   "servers": message.server.id,
-                                   "last_message_channel": message.channel.id,
-                                   "last_active": message.timestamp,
-                                   "last_message": message.timestamp}, type=1)
-
-            self.db.update_member(message.author, {"message_count": self.db.get_attribute(message.author, "message_count") + 1})
+            await self.db.record_activity(message.author,
+                                          {"aliases": message.author.name,
+                                           "servers": message.server.id,
+                                           "last_message_channel": message.channel.id,
+                                           "last_active": message.timestamp,
+                                           "last_message": message.timestamp}, type=1)
 
         if message.author == self.user:
             return
         if message.content == self.config.prefix:
             return
 
-        if message.author.id in self.config.blacklist:
+        if message.author.id in self.config.state.blacklisted:
             return
 
-        for word in message.content.split():
-            if message.channel.id in self.config.get("ignoreChannels"):
-                break
-            if word in self.config.wordFilter:
+        if message.channel.id not in self.config.get("ignoreChannels"):
+            word = self.config.filter.search(message.content)
+            if word is not None:
                 embed = discord.Embed(title="Word Filter Hit",
                                       description="At least one filtered " +
                                                   "word was detected",
@@ -468,36 +515,35 @@ class Petal(discord.Client):
                 embed.set_thumbnail(url=message.author.avatar_url)
                 await self.embed(self.get_channel(self.config.modChannel),
                                  embed)
-                break
 
-        if (message.channel.id == self.config.get("roleGrant")["chan"]
-           and discord.utils.get(self.mainsvr.roles,
-                                 id=self.config.get("roleGrant")["role"])
-           not in message.author.roles):
-            try:
-                if self.config.get("roleGrant")["ignorecase"]:
-                    check = re.compile(self.config.get("roleGrant")["regex"],
-                                       re.IGNORECASE)
-                else:
-                    check = re.compile(self.config.get("roleGrant")["regex"])
-
-                if check.match(message.content):
-                    await self.send_message(None, message.channel, self.config.get("roleGrant")
-                    ["response"], )
-                    await self.add_roles(message.author,
-                                         discord.utils.get(self.mainsvr.roles,
-                                                           id=self.config
-                                                           .get("roleGrant")
-                                                           ["role"]))
-                    log.member(message.author.name + " (id: " +
-                               message.author.id + ") was given access")
-                    # Add logging later
+        rules = self.role_grants.get(message.channel.id)
+        if rules:
+            held = {r.id for r in message.author.roles}
+            for rule in rules:
+                if rule.role is not None and rule.role.id in held:
+                    continue
+                if not rule.pattern.match(message.content):
+                    continue
+                if rule.role is None:
+                    log.err("roleGrant role " + rule.role_key + " could not be"
+                            " found, " + message.author.id + " was not given it")
+                    await self.send_message(None, message.channel, "Something went wrong will granting" +
+                                            " your role. Pm a member of staff", )
                     return
-
-            except Exception as e:
-                await self.send_message(None, message.channel, "Something went wrong will granting" +
-                                        " your role. Pm a member of staff " +
-                                        str(e), )
+                try:
+                    await self.add_roles(message.author, rule.role)
+                except Exception as e:
+                    log.err("Could not give " + message.author.id + " the role "
+                            + rule.role_key + ": " + type(e).__name__ + " " + str(e))
+                    await self.send_message(None, message.channel, "Something went wrong will granting" +
+                                            " your role. Pm a member of staff " +
+                                            str(e), )
+                    return
+                log.member(message.author.name + " (id: " +
+                           message.author.id + ") was given access")
+                await self.send_message(None, message.channel,
+                                        rule.response)
+                return
 
         if not self.config.pm and message.channel.is_private:
             if not message.author == self.user:
@@ -508,53 +554,38 @@ class Petal(discord.Client):
         if not content.startswith(self.config.prefix):
             return
         com = content[len(self.config.prefix):].lower().strip()
+        if com == "":
+            return
 
-        if com.split()[0] in dir(self.commands):
-            methodToCall = getattr(self.commands, com.split()[0])
-            if methodToCall.__doc__ is None:
-                log.warn("All commands require a docstring to not be " +
-                         "ignored. If you don't know what caused this, " +
-                         "it's safe to ignore the warning.")
-                return
-            log.com("[{0}] [{1}] [{1.id}] [{2}] ".format(message.channel,
-                                                         message.author,
-                                                         com))
-            if not message.channel.is_private:
-                self.db.update_member(message.author,
-                                      {"aliases": message.author.name,
-                                       "servers": message.author.server.id,
-                                       "last_message_channel": message.channel.id,
-                                       "last_active": message.timestamp,
-                                       "last_message": message.timestamp}, type=2)
-            response = await methodToCall(message)
-            if response:
-                self.config.get("stats")["comCount"] += 1
-                await self.send_message(message.author, message.channel, response, )
-                return
-
-        else:
-            if com.split()[0] in self.config.aliases:
-                aliased = self.config.aliases[com.split()[0]]
-                methodToCall = getattr(self.commands, aliased)
-                log.com("[{0}] [{1}] [{1.id}] [{2}] ".format(message.channel,
-                                                             message.author,
-                                                             com))
-                response = await methodToCall(message)
-                if response:
-                    self.config.get("stats")["comCount"] += 1
-                    await self.send_message(message.author, message.channel, response, )
-                    return
+        entry = self.commands.registry.get(com.split()[0])
+        if entry is None:
+            return
+        kind, methodToCall = entry
 
-            if com.split()[0] in self.config.commands:
-                response = await self.commands.parseCustom(com, message)
-                await self.send_message(message.author, message.channel, response, )
-
-            # else:
-            #    return
-            #
-            #    log.com("[{0}] [{1}] [{1.id}] [Cleverbot][{2}]"
-            #            .format(message.channel, message.author,
-            #                    message.content.lstrip(self.config.prefix)))
-            #    response = await self.commands.cleverbot(message)
-            #    await self.send_message(message.channel, response, )
+        if kind == "custom":
+            response = await methodToCall(com, message)
+            await self.send_message(message.author, message.channel, response, )
             return
+
+        log.com("[{0}] [{1}] [{1.id}] [{2}] ".format(message.channel,
+                                                     message.author,
+                                                     com),
+                channel=message.channel.id, author=message.author.id,
+                server=None if message.server is None else message.server.id,
+                command=com.split()[0])
+        if kind == "command" and not message.channel.is_private:
+            await self.db.record_activity(message.author, {}, type=2)
+        response = await methodToCall(message)
+        if response:
+            self.config.state.incr("comCount")
+            await self.send_message(message.author, message.channel, response, )
+
+        # else:
+        #    return
+        #
+        #    log.com("[{0}] [{1}] [{1.id}] [Cleverbot][{2}]"
+        #            .format(message.channel, message.author,
+        #                    message.content.lstrip(self.config.prefix)))
+        #    response = await self.commands.cleverbot(message)
+        #    await self.send_message(message.channel, response, )
+        return
@@ -0,0 +1,275 @@
+"""
+Whitelist database for mcname. Players are kept in SQLite, keyed by uuid
+with indexes on lowercase name, discord id and alt names, so a lookup or a
+change to one player never touches the rest of the file
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from .grasslands import Peacock
+log = Peacock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    discord TEXT,
+    approved TEXT NOT NULL DEFAULT '[]',
+    submitted TEXT,
+    suspended INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name_lower);
+CREATE INDEX IF NOT EXISTS players_discord ON players (discord);
+CREATE TABLE IF NOT EXISTS altnames (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS altnames_uuid ON altnames (uuid);
+CREATE INDEX IF NOT EXISTS altnames_name ON altnames (name_lower);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+COLUMNS = "id, uuid, name, discord, approved, submitted, suspended"
+
+
+class PlayerDB(object):
+    def __init__(self, path, legacy=None):
+        """
+        :param path: sqlite file to keep players in
+        :param legacy: old playerdb.json, imported the first time path is
+            opened
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if legacy is not None:
+            self.import_json(legacy)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Holds the lock and a write transaction, rolled back on any error
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def select(self, where, args=(), limit=-1):
+        """
+        :return: list of player records matching the WHERE clause, oldest
+            entry first
+        """
+        query = where + " ORDER BY id LIMIT ?"
+        args = tuple(args) + (limit,)
+        with self.lock:
+            rows = self.conn.execute("SELECT " + COLUMNS + " FROM players "
+                                     + query, args).fetchall()
+            if not rows:
+                return []
+            # Every matched player's alt names in one query
+            alts = {}
+            for uuid, alt in self.conn.execute(
+                    "SELECT uuid, name FROM altnames WHERE uuid IN "
+                    "(SELECT uuid FROM players " + query + ") ORDER BY id",
+                    args):
+                alts.setdefault(uuid, []).append(alt)
+        return [self.record(row, alts.get(row[1], [])) for row in rows]
+
+    @staticmethod
+    def record(row, alts):
+        """
+        Builds the dict mcname works with from a players row
+        """
+        pid, uuid, name, discord, approved, submitted, suspended = row
+        return OrderedDict([("name", name), ("uuid", uuid),
+                            ("altname", alts), ("discord", discord),
+                            ("approved", json.loads(approved)),
+                            ("submitted", submitted),
+                            ("suspended", bool(suspended))])
+
+    # Lookups
+
+    def get(self, uuid):
+        found = self.select("WHERE uuid = ?", (uuid,))
+        return found[0] if found else None
+
+    def find(self, target):
+        """
+        Finds one player by uuid, then minecraft name, then discord id
+        :param target: str any of the three
+        :return: player record or None
+        """
+        for where, arg in (("WHERE uuid = ?", target),
+                           ("WHERE name_lower = ?", target.lower()),
+                           ("WHERE discord = ?", target)):
+            found = self.select(where, (arg,), limit=1)
+            if found:
+                return found[0]
+        return None
+
+    def search(self, term):
+        """
+        :param term: str uuid, discord id, or current or past minecraft name
+        :return: list of every player it refers to
+        """
+        low = term.lower()
+        return self.select(
+            "WHERE uuid = ? OR name_lower = ? OR discord = ? OR uuid IN "
+            "(SELECT uuid FROM altnames WHERE name_lower = ?)",
+            (term, low, term, low))
+
+    def all(self):
+        return self.select("")
+
+    def pending(self):
+        return self.select("WHERE approved = '[]'")
+
+    def suspended(self):
+        return self.select("WHERE suspended = 1")
+
+    # Changes
+
+    @staticmethod
+    def write(conn, player, replace=False):
+        """
+        Inserts a player, or updates them in place if replace is set so
+        they keep their position. Caller holds a transaction
+        :return: False if the player exists and replace isn't set
+        """
+        values = (player["name"], player["name"].lower(),
+                  player.get("discord"),
+                  json.dumps(list(player.get("approved", []))),
+                  player.get("submitted"),
+                  int(bool(player.get("suspended"))), player["uuid"])
+        cur = None
+        if replace:
+            cur = conn.execute("UPDATE players SET name = ?, name_lower = ?, "
+                               "discord = ?, approved = ?, submitted = ?, "
+                               "suspended = ? WHERE uuid = ?", values)
+        if cur is None or cur.rowcount == 0:
+            cur = conn.execute("INSERT OR IGNORE INTO players (name, "
+                               "name_lower, discord, approved, submitted, "
+                               "suspended, uuid) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               values)
+            if cur.rowcount == 0:
+                return False
+        conn.execute("DELETE FROM altnames WHERE uuid = ?", (player["uuid"],))
+        conn.executemany("INSERT INTO altnames (uuid, name, name_lower) "
+                         "VALUES (?, ?, ?)",
+                         [(player["uuid"], alt, alt.lower())
+                          for alt in player.get("altname", [])])
+        return True
+
+    def add(self, player):
+        """
+        :param player: player record
+        :return: False if the uuid is already in the database
+        """
+        with self.transaction() as conn:
+            return self.write(conn, player)
+
+    def put(self, players):
+        """
+        Stores or replaces several players in one transaction
+        :param players: iterable of player records
+        """
+        with self.transaction() as conn:
+            for player in players:
+                self.write(conn, player, replace=True)
+
+    def approve(self, uuid, sponsor):
+        """
+        :param uuid: player's uuid
+        :param sponsor: discord id of the approver
+        :return: number of approvers now, or None if sponsor had already
+            approved or the player doesn't exist
+        """
+        with self.transaction() as conn:
+            row = conn.execute("SELECT approved FROM players WHERE uuid = ?",
+                               (uuid,)).fetchone()
+            if row is None:
+                return None
+            approved = json.loads(row[0])
+            if sponsor in approved:
+                return None
+            approved.append(sponsor)
+            conn.execute("UPDATE players SET approved = ? WHERE uuid = ?",
+                         (json.dumps(approved), uuid))
+            return len(approved)
+
+    def set_suspended(self, uuid, suspended=True):
+        """
+        :return: the player's previous suspended flag, None if not found
+        """
+        with self.transaction() as conn:
+            row = conn.execute("SELECT suspended FROM players WHERE uuid = ?",
+                               (uuid,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE players SET suspended = ? WHERE uuid = ?",
+                         (int(suspended), uuid))
+            return bool(row[0])
+
+    # Migration
+
+    def import_json(self, path):
+        """
+        Copies the players from the old json database. Only runs once per
+        database file
+        :param path: playerdb.json
+        :return: number of players imported
+        :raises ValueError: if path can't be read as a player list
+        """
+        with self.lock:
+            done = self.conn.execute("SELECT value FROM meta "
+                                     "WHERE key = 'imported'").fetchone()
+        if done is not None:
+            return 0
+        try:
+            with open(path) as f:
+                players = json.load(f, object_pairs_hook=OrderedDict)
+        except FileNotFoundError:
+            players = []
+        except ValueError as e:
+            raise ValueError(path + " is not valid JSON, fix or remove it "
+                             "to finish the import (" + str(e) + ")")
+        if not isinstance(players, list):
+            raise ValueError(path + " should hold a list of players")
+        count = 0
+        with self.transaction() as conn:
+            for player in players:
+                if not isinstance(player, dict) \
+                        or not isinstance(player.get("uuid"), str) \
+                        or not isinstance(player.get("name"), str):
+                    log.err("Skipping malformed player entry: " + str(player))
+                    continue
+                count += self.write(conn, player)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) "
+                         "VALUES ('imported', ?)", (path,))
+        if count:
+            log.f("playerdb", "Imported " + str(count) + " players from "
+                  + path)
+        return count
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,135 @@
+"""
+Reminder delivery for petal. Only reminders due within the next window are
+held in memory, the rest stay in the database until their window comes up.
+Reminders that come due together are sent together and deleted in one go
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime
+from .grasslands import Peacock
+log = Peacock()
+
+
+class Reminders(object):
+    def __init__(self, client, window=3600, batch=50):
+        """
+        :param client: the Petal client, for its db and scheduler
+        :param window: seconds of upcoming reminders to keep loaded
+        :param batch: most reminders sent at once
+        """
+        self.client = client
+        self.db = client.db
+        self.scheduler = client.scheduler
+        self.window = window
+        self.batch = batch
+        self.heap = []
+        self.queued = set()
+        self.seq = itertools.count()
+        self.loaded_until = None
+        self.loading_until = None
+        # Ids delivered while a window query was in flight, which it may
+        # still return
+        self.sent = set()
+        self.scheduler.register("reminders", self.deliver_due)
+        self.scheduler.register("reminder-window", self.load_window)
+
+    def __len__(self):
+        return len(self.queued)
+
+    def push(self, doc):
+        if doc["_id"] in self.queued:
+            return
+        self.queued.add(doc["_id"])
+        heapq.heappush(self.heap, (doc["ts"], next(self.seq), doc))
+
+    def wake(self):
+        if self.heap:
+            self.scheduler.schedule(self.heap[0][0], "reminders",
+                                    key=("reminders",))
+
+    async def start(self):
+        """
+        Loads the first window. It has no lower bound, so reminders missed
+        while petal was offline are sent straight away
+        """
+        if self.loaded_until is None:
+            await self.load_window()
+
+    async def load_window(self, payload=None):
+        until = time.time() + self.window
+        self.loading_until = until
+        self.sent = set()
+        docs = await self.db.get_reminders(until, after=self.loaded_until)
+        for doc in docs:
+            if doc["_id"] not in self.sent:
+                self.push(doc)
+        self.loaded_until = until
+        self.loading_until = None
+        self.sent = set()
+        self.scheduler.schedule(until - self.window / 2, "reminder-window",
+                                key=("reminder-window",))
+        log.f("remind", "Loaded " + str(len(docs)) + " reminders, "
+              + str(len(self)) + " pending")
+        self.wake()
+
+    async def add(self, author, content, due, channel=None):
+        """
+        Stores a reminder, queueing it right away if it falls in the loaded
+        window or the one being loaded
+        :param author: member to remind
+        :param content: str reminder text
+        :param due: unix timestamp
+        :param channel: channel id to remind in, None to PM
+        :return: the stored reminder
+        """
+        doc = await self.db.add_reminder(author, content, due, channel)
+        horizon = max(self.loaded_until or 0, self.loading_until or 0)
+        if doc["ts"] <= horizon:
+            self.push(doc)
+            self.wake()
+        return doc
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now and len(due) < self.batch:
+            doc = heapq.heappop(self.heap)[2]
+            self.queued.discard(doc["_id"])
+            due.append(doc)
+        return due
+
+    async def deliver_due(self, payload=None):
+        due = self.pop_due(time.time())
+        while due:
+            results = await asyncio.gather(*[self.deliver(d) for d in due],
+                                           return_exceptions=True)
+            for doc, result in zip(due, results):
+                if isinstance(result, Exception):
+                    log.err("Reminder for " + doc["author"] + " failed: "
+                            + type(result).__name__ + " " + str(result))
+            if self.loading_until is not None:
+                self.sent.update(d["_id"] for d in due)
+            await self.db.delete_reminders([d["_id"] for d in due])
+            due = self.pop_due(time.time())
+        self.wake()
+
+    async def deliver(self, doc):
+        # A zero width space keeps @everyone/@here in old reminders from pinging
+        content = doc["content"].replace("@everyone", "@\u200beveryone") \
+                                .replace("@here", "@\u200bhere")
+        message = "<@{}> you asked me to remind you: {}".format(
+            doc["author"], content)
+        late = time.time() - doc["ts"]
+        if late > 60:
+            message += "\n(Sorry, this was due at {} UTC)".format(
+                datetime.utcfromtimestamp(doc["ts"])
+                .strftime("%Y-%m-%d %H:%M:%S"))
+
+        channel = None
+        if doc.get("channel") is not None:
+            channel = self.client.get_channel(doc["channel"])
+        if channel is None:
+            channel = await self.client.get_user_info(doc["author"])
+        return await self.client.send_message(None, channel, message)
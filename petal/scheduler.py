@@ -0,0 +1,101 @@
+"""
+Timed jobs for petal. Everything due is kept in one heap and a single
+coroutine sleeps until the earliest job, instead of polling
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from .grasslands import Peacock
+log = Peacock()
+
+
+class Scheduler(object):
+    # Longest single sleep, so a changed system clock is noticed eventually
+    MAX_SLEEP = 300
+
+    def __init__(self):
+        self.heap = []
+        self.live = {}
+        self.handlers = {}
+        self.seq = itertools.count()
+        self.wake = None
+        self.running = False
+
+    def __len__(self):
+        return len(self.live)
+
+    def register(self, kind, handler):
+        """
+        :param kind: name jobs are scheduled under
+        :param handler: coroutine function called with the job's payload
+        """
+        self.handlers[kind] = handler
+
+    def schedule(self, due, kind, payload=None, key=None):
+        """
+        Adds a job, replacing any pending job with the same key
+        :param due: unix timestamp to run at, past timestamps run right away
+        :param kind: registered handler name
+        :param payload: passed to the handler
+        :param key: identifies the job for cancel(), defaults to a new one
+        :return: the job key
+        """
+        if key is None:
+            key = (kind, next(self.seq))
+        entry = [float(due), next(self.seq), key, kind, payload]
+        self.live[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self.wake is not None and self.heap[0] is entry:
+            self.wake.set()
+        return key
+
+    def cancel(self, key):
+        """
+        Drops a pending job. Its heap entry is skipped when it comes up
+        :return: True if the job was pending
+        """
+        return self.live.pop(key, None) is not None
+
+    def due(self, now):
+        """
+        Pops every live job due at or before now
+        """
+        jobs = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            if self.live.get(entry[2]) is not entry:
+                continue
+            del self.live[entry[2]]
+            jobs.append(entry)
+        return jobs
+
+    async def dispatch(self, kind, key, payload):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            log.err("No scheduler handler for " + str(kind))
+            return
+        try:
+            await handler(payload)
+        except Exception as e:
+            log.err("Scheduled " + str(kind) + " job " + str(key)
+                    + " failed: " + type(e).__name__ + " " + str(e))
+
+    async def run(self):
+        if self.running:
+            return
+        self.running = True
+        self.wake = asyncio.Event()
+        while True:
+            now = time.time()
+            for due, seq, key, kind, payload in self.due(now):
+                asyncio.ensure_future(self.dispatch(kind, key, payload))
+            delay = self.MAX_SLEEP
+            if self.heap:
+                delay = min(max(self.heap[0][0] - now, 0), self.MAX_SLEEP)
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,258 @@
+"""
+Runtime state for petal. Counters, hug donors, lvotes, the blacklist and the
+image galleries change all the time, so they live in a small SQLite file
+instead of config.yml. Each update is a single row write
+"""
+
+import json
+import random
+import sqlite3
+import threading
+from datetime import datetime
+from .grasslands import Peacock
+log = Peacock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS donors (
+    uid TEXT PRIMARY KEY,
+    name TEXT,
+    donations INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS blacklist (
+    uid TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS votes (
+    uid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS gallery (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    author TEXT,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS gallery_name ON gallery (name);
+"""
+
+# config.yml gallery key -> gallery name in the store
+GALLERIES = {"calmGallery": "calm",
+             "comfyGallery": "comfy",
+             "cuteGallery": "cute"}
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def encode_vote(entry):
+    data = dict(entry)
+    if isinstance(data.get("timeout"), datetime):
+        data["timeout"] = data["timeout"].strftime(TIME_FORMAT)
+    data["votes"] = dict(data.get("votes", {}))
+    return json.dumps(data)
+
+
+def decode_vote(text):
+    data = json.loads(text)
+    if data.get("timeout") is not None:
+        data["timeout"] = datetime.strptime(data["timeout"], TIME_FORMAT)
+    return data
+
+
+class StateStore(object):
+    def __init__(self, path="state.db"):
+        """
+        :param path: sqlite file to keep state in
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.blacklisted = frozenset(
+            r[0] for r in self.conn.execute("SELECT uid FROM blacklist"))
+        log.f("state", "Using state file: " + path)
+
+    def execute(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args)
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    # Counters
+
+    def counter(self, name):
+        row = self.query("SELECT value FROM counters WHERE name = ?", (name,))
+        return row[0][0] if row else 0
+
+    def incr(self, name, by=1):
+        """
+        Adds to a counter, creating it if needed
+        :return: the new value
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO counters (name) "
+                              "VALUES (?)", (name,))
+            self.conn.execute("UPDATE counters SET value = value + ? "
+                              "WHERE name = ?", (by, name))
+            return self.conn.execute("SELECT value FROM counters "
+                                     "WHERE name = ?", (name,)).fetchone()[0]
+
+    # Key/value
+
+    def get(self, key, default=None):
+        row = self.query("SELECT value FROM kv WHERE key = ?", (key,))
+        return row[0][0] if row else default
+
+    def set(self, key, value):
+        self.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                     (key, None if value is None else str(value)))
+
+    # Hug donors
+
+    def donors(self):
+        return {uid: {"name": name, "donations": donations}
+                for uid, name, donations in
+                self.query("SELECT uid, name, donations FROM donors")}
+
+    def is_donor(self, uid):
+        return bool(self.query("SELECT 1 FROM donors WHERE uid = ?", (uid,)))
+
+    def donations(self, uid):
+        row = self.query("SELECT donations FROM donors WHERE uid = ?", (uid,))
+        return row[0][0] if row else None
+
+    def add_donor(self, uid, name, donations=0):
+        self.execute("INSERT OR REPLACE INTO donors (uid, name, donations) "
+                     "VALUES (?, ?, ?)", (uid, name, donations))
+
+    def remove_donor(self, uid):
+        self.execute("DELETE FROM donors WHERE uid = ?", (uid,))
+
+    def add_donation(self, uid):
+        self.execute("UPDATE donors SET donations = donations + 1 "
+                     "WHERE uid = ?", (uid,))
+
+    # Blacklist
+
+    def blacklist(self, uid):
+        self.execute("INSERT OR IGNORE INTO blacklist (uid) VALUES (?)",
+                     (uid,))
+        self.blacklisted = self.blacklisted | {uid}
+
+    def unblacklist(self, uid):
+        self.execute("DELETE FROM blacklist WHERE uid = ?", (uid,))
+        self.blacklisted = self.blacklisted - {uid}
+
+    # lvotes (choppingBlock)
+
+    def votes(self):
+        return {uid: decode_vote(data) for uid, data in
+                self.query("SELECT uid, data FROM votes")}
+
+    def get_vote(self, uid):
+        row = self.query("SELECT data FROM votes WHERE uid = ?", (uid,))
+        return decode_vote(row[0][0]) if row else None
+
+    def put_vote(self, uid, entry):
+        self.execute("INSERT OR REPLACE INTO votes (uid, data) VALUES (?, ?)",
+                     (uid, encode_vote(entry)))
+
+    def delete_vote(self, uid):
+        self.execute("DELETE FROM votes WHERE uid = ?", (uid,))
+
+    # Galleries
+
+    def gallery_add(self, name, author, content):
+        self.execute("INSERT INTO gallery (name, author, content) "
+                     "VALUES (?, ?, ?)", (name, author, content))
+
+    def gallery_count(self, name):
+        return self.query("SELECT COUNT(*) FROM gallery WHERE name = ?",
+                          (name,))[0][0]
+
+    def gallery_random(self, name):
+        """
+        Picks a random gallery entry by rowid. Both lookups are index seeks
+        on (name, id) and run under one lock, so a concurrent delete can't
+        make the pick miss
+        :return: the entry's content or None if the gallery is empty
+        """
+        with self.lock:
+            low, high = self.conn.execute(
+                "SELECT MIN(id), MAX(id) FROM gallery WHERE name = ?",
+                (name,)).fetchone()
+            if low is None:
+                return None
+            row = self.conn.execute(
+                "SELECT content FROM gallery WHERE name = ? AND id >= ? "
+                "ORDER BY id LIMIT 1",
+                (name, random.randint(low, high))).fetchone()
+        return row[0] if row else None
+
+    # Migration
+
+    def import_config(self, doc):
+        """
+        Copies the runtime state that used to live in config.yml. Only runs
+        once per state file, later changes to those config keys are ignored
+        :param doc: the config doc
+        """
+        if self.get("imported") is not None:
+            return False
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN")
+            try:
+                for name, value in (doc.get("stats") or {}).items():
+                    conn.execute("INSERT OR REPLACE INTO counters "
+                                 "(name, value) VALUES (?, ?)",
+                                 (name, int(value)))
+                for uid, donor in (doc.get("hugDonors") or {}).items():
+                    conn.execute("INSERT OR REPLACE INTO donors "
+                                 "(uid, name, donations) VALUES (?, ?, ?)",
+                                 (str(uid), donor.get("name"),
+                                  int(donor.get("donations", 0))))
+                for uid in doc.get("blacklist") or []:
+                    conn.execute("INSERT OR IGNORE INTO blacklist (uid) "
+                                 "VALUES (?)", (str(uid),))
+                for uid, entry in (doc.get("choppingBlock") or {}).items():
+                    conn.execute("INSERT OR REPLACE INTO votes (uid, data) "
+                                 "VALUES (?, ?)",
+                                 (str(uid), encode_vote(entry)))
+                for key, name in GALLERIES.items():
+                    for entry in doc.get(key) or []:
+                        conn.execute("INSERT INTO gallery "
+                                     "(name, author, content) "
+                                     "VALUES (?, ?, ?)",
+                                     (name, entry.get("author"),
+                                      entry["content"]))
+                if doc.get("lastRun") is not None:
+                    conn.execute("INSERT OR REPLACE INTO kv (key, value) "
+                                 "VALUES ('lastRun', ?)",
+                                 (str(doc["lastRun"]),))
+                conn.execute("INSERT OR REPLACE INTO kv (key, value) "
+                             "VALUES ('imported', ?)",
+                             (str(datetime.utcnow()),))
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            self.blacklisted = frozenset(
+                r[0] for r in conn.execute("SELECT uid FROM blacklist"))
+        log.f("state", "Imported runtime state from config.yml")
+        return True
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,76 @@
+"""
+Finds which sub an event post is about. Sub codes and the words of sub
+names are indexed, so a post is matched with one pass over its words
+"""
+
+import re
+
+# Explicit tags look like [CODE]
+TAG = re.compile(r"\[([^\[\]\s]+)\]")
+
+# Words too common in game names to identify one
+STOPWORDS = frozenset(["and", "of", "the", "or", "with", "to", "from", "by",
+                       "on"])
+
+
+class SubIndex(object):
+    def __init__(self, subs=()):
+        """
+        :param subs: iterable of sub documents (code, name)
+        """
+        self.names = {}
+        self.codes = {}
+        self.words = {}
+        for sub in subs:
+            self.add(sub["code"], sub["name"])
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def tokens(name):
+        return [w for w in name.lower().split() if w not in STOPWORDS]
+
+    def add(self, code, name):
+        self.remove(code)
+        self.names[code] = name
+        self.codes[code.lower()] = code
+        for word in self.tokens(name):
+            codes = self.words.setdefault(word, [])
+            if code not in codes:
+                codes.append(code)
+
+    def remove(self, code):
+        name = self.names.pop(code, None)
+        if name is None:
+            return
+        self.codes.pop(code.lower(), None)
+        for word in self.tokens(name):
+            codes = self.words.get(word)
+            if codes is None:
+                continue
+            if code in codes:
+                codes.remove(code)
+            if not codes:
+                del self.words[word]
+
+    def find(self, post):
+        """
+        An explicit [CODE] tag wins. Otherwise the first word of the post
+        that is a sub code or part of a sub's name picks the sub
+        :param post: str event announcement
+        :return: (code, name), or (None, None) if no sub matched
+        """
+        for match in TAG.finditer(post):
+            code = match.group(1)
+            if code in self.names:
+                return code, self.names[code]
+        for word in post.lower().split():
+            code = self.codes.get(word)
+            if code is None:
+                codes = self.words.get(word)
+                if not codes:
+                    continue
+                code = codes[0]
+            return code, self.names[code]
+        return None, None
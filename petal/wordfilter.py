@@ -0,0 +1,100 @@
+"""
+Word filter for petal. Every filtered word is compiled into a single
+Aho-Corasick automaton so checking a message only depends on its length
+"""
+
+import string
+from collections import deque
+
+# Common character swaps used to dodge the filter (h4x0r -> haxor)
+LEET = str.maketrans("0134578@$", "oieastbas")
+PUNCTUATION = str.maketrans("", "", string.punctuation)
+
+
+class WordFilter(object):
+    def __init__(self, words, ignorecase=True, punctuation=True,
+                 leetspeak=True):
+        """
+        :param words: list of words/phrases to filter
+        :param ignorecase: match regardless of case
+        :param punctuation: ignore punctuation inside and around words
+        :param leetspeak: treat common number/symbol swaps as letters
+        """
+        self.ignorecase = ignorecase
+        self.punctuation = punctuation
+        self.leetspeak = leetspeak
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.terms = {}
+
+        for word in words or []:
+            self.add(str(word))
+        self.link()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def normalize(self, text):
+        if self.ignorecase:
+            text = text.lower()
+        if self.leetspeak:
+            text = text.translate(LEET)
+        if self.punctuation:
+            text = text.translate(PUNCTUATION)
+        return " ".join(text.split())
+
+    def add(self, word):
+        key = self.normalize(word)
+        if key == "" or key in self.terms:
+            return
+        node = 0
+        for ch in key:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(())
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.out[node] += (key,)
+        self.terms[key] = word
+
+    def link(self):
+        """
+        Computes the failure links breadth first, merging the outputs of each
+        node's fallback into its own
+        """
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def search(self, text):
+        """
+        Finds the first filtered word in text. Only whole words count, so
+        filtering "ass" does not flag "class"
+        :param text: str message content
+        :return: the filtered word as written in config, or None
+        """
+        text = self.normalize(text)
+        end = len(text) - 1
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for key in self.out[node]:
+                start = i - len(key) + 1
+                if ((start == 0 or text[start - 1] == " ")
+                   and (i == end or text[i + 1] == " ")):
+                    return self.terms[key]
+        return None
@@ -0,0 +1,69 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from petal.dbhandler import ActivityBuffer
+
+
+def member(uid):
+    return SimpleNamespace(id=uid, name="user" + uid, display_name="user" + uid,
+                           discriminator="0001",
+                           created_at=datetime(2017, 1, 1), bot=False,
+                           avatar_url="")
+
+
+class FailingCollection(object):
+    def __init__(self, error):
+        self.error = error
+        self.calls = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls.append(ops)
+        raise self.error
+
+
+class ActivityBufferFlushTest(unittest.TestCase):
+    def test_failed_write_keeps_counters(self):
+        buf = ActivityBuffer(FailingCollection(AutoReconnect("down")))
+        buf.record(member("1"), {}, type=1)
+        buf.record(member("1"), {}, type=2)
+        buf.record(member("2"), {}, type=1)
+
+        with self.assertRaises(AutoReconnect):
+            buf.flush()
+
+        self.assertEqual(buf.pending["1"]["inc"],
+                         {"message_count": 1, "commands_count": 1})
+        self.assertEqual(buf.pending["2"]["inc"], {"message_count": 1})
+
+    def test_failed_write_merges_with_new_activity(self):
+        buf = ActivityBuffer(FailingCollection(AutoReconnect("down")))
+        buf.record(member("1"), {"servers": "a"}, type=1)
+        with self.assertRaises(AutoReconnect):
+            buf.flush()
+        buf.record(member("1"), {"servers": "b"}, type=1)
+
+        self.assertEqual(buf.pending["1"]["inc"], {"message_count": 2})
+        self.assertEqual(buf.pending["1"]["add"], {"servers": ["a", "b"]})
+
+    def test_bulk_write_error_keeps_only_failed_ops(self):
+        error = BulkWriteError({"writeErrors": [{"index": 1, "code": 11000,
+                                                 "errmsg": "dup"}],
+                                "nModified": 1})
+        collection = FailingCollection(error)
+        buf = ActivityBuffer(collection)
+        buf.record(member("1"), {}, type=1)
+        buf.record(member("2"), {}, type=1)
+
+        with self.assertRaises(BulkWriteError):
+            buf.flush()
+
+        failed = collection.calls[0][1]._filter["uid"]
+        self.assertEqual(list(buf.pending), [failed])
+        self.assertEqual(buf.pending[failed]["inc"], {"message_count": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()